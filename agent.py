@@ -7,64 +7,243 @@ from langchain_core.messages import HumanMessage
 from langchain import hub
 from dotenv import load_dotenv
 import base64
+import io
+import threading
+import functools
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 # Load environment variables
 load_dotenv(".env")
 
 # Import tools
 try:
-    from tools_ocr import process_raw_text
-    from tools_similarity import calculate_similarity
+    from tools_ocr import process_raw_text, cached_extract, extract_text_routed, VISION_QUALITY_THRESHOLD, doc_text_cache
+    from tools_similarity import calculate_similarity, embed_texts, get_sim_model
     from tools_skills import compare_skills_tool
+    from tools_courses import get_course_recommendations
+    from tools_session import session_store, current_session_id, use_session, DEFAULT_SESSION_ID
+    from tools_llm_cache import llm_cache
 except ImportError as e:
     print(f"IMPORT ERROR: {e}")
     print("MAKE SURE THAT THEY EXIST IN THE data/ DIRECTORY")
     exit()
 
 
-# Global variables to store extracted texts
-CV_TEXT_STORAGE = ""
-JD_TEXT_STORAGE = ""
+# CV/JD và kết quả dẫn xuất nằm trong session_store theo session ID (không còn biến global)
+# Đổi text CV/JD thì các kết quả tính từ nó không còn đúng
+DERIVED_KEYS = ("score", "skills", "courses", "cv_embedding", "jd_embedding")
+
+# "pipeline": các bước xác định chạy bằng code, chỉ 1 lần gọi LLM để viết báo cáo
+# "agent": để agent tự gọi tool theo thứ tự như trước
+ANALYSIS_MODES = ("pipeline", "agent")
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "pipeline")
+
+# Giới hạn pool kết nối HTTP dùng chung cho mọi lời gọi OpenAI
+LLM_MODEL = "gpt-4o"
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "10"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+
+
+# ===== CLIENT / EXECUTOR DÙNG CHUNG =====
+_http_client = None
+_async_http_client = None
+_llm_clients = {}
+_agent_executors = {}
+_client_lock = threading.RLock()
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+def _get_http_client() -> httpx.Client:
+    global _http_client
+    with _client_lock:
+        if _http_client is None:
+            _http_client = httpx.Client(limits=_http_limits(), timeout=LLM_TIMEOUT)
+        return _http_client
+
+
+def _get_async_http_client() -> httpx.AsyncClient:
+    # Dùng cho ainvoke; client async gắn với event loop dùng nó (xem engine.py: một loop cho cả process)
+    global _async_http_client
+    with _client_lock:
+        if _async_http_client is None:
+            _async_http_client = httpx.AsyncClient(limits=_http_limits(), timeout=LLM_TIMEOUT)
+        return _async_http_client
+
+
+def get_llm(model: str = LLM_MODEL, temperature: float = 0, streaming: bool = False) -> ChatOpenAI:
+    """
+    ChatOpenAI dùng lại cho cả process (thread-safe), chung một pool kết nối keep-alive.
+    streaming=True: token được đẩy ra callback on_llm_new_token ngay khi model sinh ra.
+    """
+    key = (model, temperature, streaming)
+    llm = _llm_clients.get(key)
+    if llm is None:
+        with _client_lock:
+            llm = _llm_clients.get(key)
+            if llm is None:
+                # cache=llm_cache: cùng model + prompt + tool message (temperature 0) thì không gọi lại OpenAI
+                llm = ChatOpenAI(model=model, temperature=temperature, streaming=streaming,
+                                 http_client=_get_http_client(), http_async_client=_get_async_http_client(),
+                                 cache=llm_cache)
+                _llm_clients[key] = llm
+    return llm
+
+
+def get_agent_executor(streaming: bool = False, run_blocking=None) -> AgentExecutor:
+    """
+    Agent dựng một lần (prompt, schema tool, client) rồi dùng lại cho mọi request.
+    run_blocking: xem initialize_agent (engine truyền vào để tool chạy trong giới hạn của engine).
+    """
+    key = (streaming, run_blocking)
+    agent_executor = _agent_executors.get(key)
+    if agent_executor is None:
+        with _client_lock:
+            agent_executor = _agent_executors.get(key)
+            if agent_executor is None:
+                agent_executor = initialize_agent(streaming, run_blocking)
+                _agent_executors[key] = agent_executor
+    return agent_executor
+
+
+def cache_stats() -> dict:
+    """Hit rate của cache LLM (text / vision) và cache text tài liệu."""
+    return {
+        "llm": llm_cache.stats() if llm_cache is not None else None,
+        "documents": doc_text_cache.stats() if doc_text_cache is not None else None,
+    }
+
+
+def check_agent_cache(cache_path=None) -> dict:
+    """
+    Kiểm tra agent thật sự đi qua cache LLM: chạy cùng một câu hỏi hai lần bằng agent dựng như
+    initialize_agent (model giả, cache SQLite tạm), lần thứ hai phải là cache hit.
+    """
+    import tempfile
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from tools_llm_cache import SQLiteLLMCache
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = SQLiteLLMCache(path=cache_path or os.path.join(tmp_dir, "llm_cache.sqlite"))
+        try:
+            llm = FakeListChatModel(responses=["1. Backend Developer - Python, SQL"], cache=cache)
+            prompt = ChatPromptTemplate.from_messages([
+                ("user", "{input}"),
+                MessagesPlaceholder(variable_name="agent_scratchpad"),
+            ])
+            executor = _build_agent_executor(llm, [tool_suggest_jobs], prompt)
+            outputs = [executor.invoke({"input": "Gợi ý việc làm cho CV này"})["output"] for _ in range(2)]
+            stats = cache.stats()
+        finally:
+            cache._conn.close()
+    assert outputs[0] == outputs[1], outputs
+    assert stats["misses"] == 1 and stats["hits"] == 1, stats
+    return stats
+
+
+def reset_clients():
+    """Bỏ client/agent đã tạo và đóng pool kết nối (vd: sau khi đổi API key hoặc giới hạn pool)."""
+    global _http_client, _async_http_client
+    with _client_lock:
+        if _http_client is not None:
+            _http_client.close()
+        _http_client = None
+        # AsyncClient phải đóng trong event loop của nó; bỏ tham chiếu để tạo mới
+        _async_http_client = None
+        _llm_clients.clear()
+        _agent_executors.clear()
 
 
 # ===== SIMPLE TOOLS - NO JSON =====
+def _extract_with_vision(file_path: str) -> str:
+    with open(file_path, "rb") as f:
+        file_bytes = f.read()
+        base64_data = base64.b64encode(file_bytes).decode('utf-8')
+    ext = file_path.lower().split('.')[-1]
+    
+    if ext == 'pdf':
+        mime_type = "application/pdf"
+    else:
+        mime_type = f"image/{ext}" if ext != 'jpg' else "image/jpeg"
+    vision_llm = get_llm()
+    message = HumanMessage(
+        content=[
+            {
+                "type": "text",
+                "text": "Trích xuất TOÀN BỘ văn bản trong file này. Giữ nguyên format và cấu trúc. Chỉ trả về text, không thêm giải thích."
+            },
+            {
+                "type": "image_url",
+                "image_url": {"url": f"data:{mime_type};base64,{base64_data}"}
+            }
+        ]
+    )
+    response = vision_llm.invoke([message])
+    return response.content
+
+
+def _extract_image_with_vision(image) -> str:
+    """Gửi ĐÚNG một trang (ảnh PIL) cho GPT-4o Vision."""
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    base64_data = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    vision_llm = get_llm()
+    message = HumanMessage(
+        content=[
+            {
+                "type": "text",
+                "text": "Trích xuất TOÀN BỘ văn bản trong ảnh này. Giữ nguyên format và cấu trúc. Chỉ trả về text, không thêm giải thích."
+            },
+            {
+                "type": "image_url",
+                "image_url": {"url": f"data:image/png;base64,{base64_data}"}
+            }
+        ]
+    )
+    response = vision_llm.invoke([message])
+    return response.content
+
+
+def _extract_local_first(file_path: str) -> str:
+    try:
+        text, stats = extract_text_routed(file_path, vision_fn=_extract_image_with_vision)
+        print(f"📄 Trích xuất {os.path.basename(file_path)}: {stats}")
+        return text
+    except Exception as e:
+        # Không đọc được bằng công cụ local thì gửi cả file như trước
+        print(f"⚠️ Local extraction failed ({e}), falling back to GPT-4o Vision")
+        return _extract_with_vision(file_path)
+
+
 @tool
 def tool_extract_text_from_file(file_path: str) -> str:
     """
-    Trích xuất văn bản từ file (PDF hoặc ảnh) bằng GPT-4o Vision.
-    Agent tự động xử lý mọi loại file.
+    Trích xuất văn bản từ file (PDF hoặc ảnh).
+    Đọc text layer / OCR local trước, chỉ những trang đọc không tốt mới gửi GPT-4o Vision.
     
     Input: đường dẫn file (PDF/PNG/JPG/JPEG)
     Output: nội dung văn bản được trích xuất
     """
     try:
-        with open(file_path, "rb") as f:
-            file_bytes = f.read()
-            base64_data = base64.b64encode(file_bytes).decode('utf-8')
-        ext = file_path.lower().split('.')[-1]
-        
-        if ext == 'pdf':
-            mime_type = "application/pdf"
-        else:
-            mime_type = f"image/{ext}" if ext != 'jpg' else "image/jpeg"
-        vision_llm = ChatOpenAI(model="gpt-4o", temperature=0)
-        message = HumanMessage(
-            content=[
-                {
-                    "type": "text",
-                    "text": "Trích xuất TOÀN BỘ văn bản trong file này. Giữ nguyên format và cấu trúc. Chỉ trả về text, không thêm giải thích."
-                },
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:{mime_type};base64,{base64_data}"}
-                }
-            ]
-        )
-        response = vision_llm.invoke([message])
-        return response.content
+        return _extract_file_text(file_path)
     except Exception as e:
         return f"ERROR: Không thể đọc file - {str(e)}"
 
 
+def _extract_file_text(file_path: str) -> str:
+    # File đã trích xuất rồi (cùng nội dung) thì lấy lại từ cache, không gọi GPT-4o
+    return cached_extract(file_path, _extract_local_first, method="routed",
+                          quality_threshold=VISION_QUALITY_THRESHOLD, model="gpt-4o")
+
+
 
 @tool
 def tool_process_text_input(raw_text: str) -> str:
@@ -86,8 +265,9 @@ def tool_store_cv_text(cv_text: str) -> str:
     Input: nội dung CV text
     Output: xác nhận đã lưu
     """
-    global CV_TEXT_STORAGE
-    CV_TEXT_STORAGE = cv_text
+    session_id = current_session_id()
+    session_store.set(session_id, cv_text=cv_text)
+    session_store.discard(session_id, *DERIVED_KEYS)
     return f"SUCCESS: Đã lưu CV text ({len(cv_text)} ký tự)"
 
 
@@ -98,8 +278,9 @@ def tool_store_jd_text(jd_text: str) -> str:
     Input: nội dung JD text
     Output: xác nhận đã lưu
     """
-    global JD_TEXT_STORAGE
-    JD_TEXT_STORAGE = jd_text
+    session_id = current_session_id()
+    session_store.set(session_id, jd_text=jd_text)
+    session_store.discard(session_id, *DERIVED_KEYS)
     return f"SUCCESS: Đã lưu JD text ({len(jd_text)} ký tự)"
 
 
@@ -110,11 +291,15 @@ def tool_calculate_match_score(dummy: str = "run") -> str:
     Input: bất kỳ string nào (không quan trọng)
     Output: điểm phù hợp dạng số
     """
-    global CV_TEXT_STORAGE, JD_TEXT_STORAGE
+    session_id = current_session_id()
+    state = session_store.get_all(session_id)
     try:
-        if not CV_TEXT_STORAGE or not JD_TEXT_STORAGE:
+        if not state.get("cv_text") or not state.get("jd_text"):
             return "ERROR: Chưa có CV hoặc JD text. Hãy lưu chúng trước."
-        score = calculate_similarity(CV_TEXT_STORAGE, JD_TEXT_STORAGE)
+        score = state.get("score")
+        if score is None:
+            score = calculate_similarity(state["cv_text"], state["jd_text"])
+            session_store.set(session_id, score=score)
         return str(score)
     except Exception as e:
         return f"ERROR: {str(e)}"
@@ -128,12 +313,16 @@ def tool_analyze_skills(dummy: str = "run") -> str:
     Output: kỹ năng có và kỹ năng thiếu, phân cách bởi |||
     Format: cv_skills: skill1, skill2 ||| missing_skills: skill3, skill4
     """
-    global CV_TEXT_STORAGE, JD_TEXT_STORAGE
+    session_id = current_session_id()
+    state = session_store.get_all(session_id)
     try:
-        if not CV_TEXT_STORAGE or not JD_TEXT_STORAGE:
+        if not state.get("cv_text") or not state.get("jd_text"):
             return "ERROR: Chưa có CV hoặc JD text."
         
-        result = compare_skills_tool(CV_TEXT_STORAGE, JD_TEXT_STORAGE)
+        result = state.get("skills")
+        if result is None:
+            result = compare_skills_tool(state["cv_text"], state["jd_text"])
+            session_store.set(session_id, skills=result)
         cv_skills = ", ".join(result.get('cv_skills', []))
         missing_skills = ", ".join(result.get('missing_skills', []))
         
@@ -159,17 +348,37 @@ def tool_suggest_jobs(dummy: str = "run") -> str:
     1. [Tên vị trí] - [Lý do phù hợp ngắn gọn]
     2. ...
     """
-    global CV_TEXT_STORAGE
+    cv_text = session_store.get(current_session_id(), "cv_text")
     
-    if not CV_TEXT_STORAGE:
+    if not cv_text:
         return "ERROR: Chưa có CV. Vui lòng phân tích CV trước."
     
     # Trả về CV để agent tự phân tích
-    return f"CV_CONTENT_FOR_ANALYSIS:\n{CV_TEXT_STORAGE[:2000]}"
+    return f"CV_CONTENT_FOR_ANALYSIS:\n{cv_text[:2000]}"
+
+# Loại tài nguyên mỗi tool dùng, để engine giới hạn số tool cùng loại chạy đồng thời (mặc định "cpu")
+TOOL_RESOURCES = {
+    "tool_extract_text_from_file": "ocr",
+    "tool_calculate_match_score": "encode",
+}
 
-def initialize_agent():
-    """Khởi tạo Agent."""
-    llm = ChatOpenAI(model="gpt-4o", temperature=0)
+
+def _engine_tools(tools, run_blocking):
+    """
+    Gắn coroutine cho từng tool: khi agent chạy bằng ainvoke, phần đồng bộ của tool chạy qua
+    run_blocking(resource, fn) (thread pool + semaphore của engine) thay vì executor mặc định của LangChain.
+    """
+    wrapped = []
+    for agent_tool in tools:
+        async def coroutine(*args, _func=agent_tool.func, _resource=TOOL_RESOURCES.get(agent_tool.name, "cpu"), **kwargs):
+            return await run_blocking(_resource, functools.partial(_func, *args, **kwargs))
+        wrapped.append(agent_tool.copy(update={"coroutine": coroutine}))
+    return wrapped
+
+
+def initialize_agent(streaming: bool = False, run_blocking=None):
+    """Khởi tạo Agent. run_blocking(resource, fn) (async, từ AnalysisEngine): chạy tool trong giới hạn của engine."""
+    llm = get_llm(streaming=streaming)
     
     tools = [
         tool_extract_text_from_file,
@@ -180,6 +389,8 @@ def initialize_agent():
         tool_analyze_skills,
         tool_suggest_jobs
     ]
+    if run_blocking is not None:
+        tools = _engine_tools(tools, run_blocking)
     system_message = """Bạn là AI Recruitment Expert chuyên nghiệp.
 
 NHIỆM VỤ:
@@ -201,32 +412,142 @@ QUAN TRỌNG:
         ("user", "{input}"),
         MessagesPlaceholder(variable_name="agent_scratchpad"),
     ])
+    return _build_agent_executor(llm, tools, prompt)
+
+
+def _build_agent_executor(llm, tools, prompt) -> AgentExecutor:
     agent = create_openai_tools_agent(llm, tools, prompt)
     
+    # stream_runnable=False: agent lập kế hoạch bằng invoke/ainvoke, đi qua llm_cache
+    # (stream/astream của chat model bỏ qua cache). LLM streaming=True vẫn đẩy token ra callback khi cache miss;
+    # cache hit thì chỉ có kết quả cuối.
     agent_executor = AgentExecutor(
         agent=agent,
         tools=tools,
         verbose=True,
         handle_parsing_errors=True,
+        stream_runnable=False,
     )
     
     return agent_executor
 
 
-def analyze_cv_jd(cv_input: str, jd_input: str, cv_type: str = "text", jd_type: str = "text"):
-    """Phân tích CV và JD."""
-    
-    global CV_TEXT_STORAGE, JD_TEXT_STORAGE
-    CV_TEXT_STORAGE = ""
-    JD_TEXT_STORAGE = ""
-    
-    print("\n" + "="*70)
-    print("🚀 BẮT ĐẦU PHÂN TÍCH")
-    print("="*70 + "\n")
-    
-    agent = initialize_agent()
-    
-    user_query = f"""
+REPORT_PROMPT = """Viết báo cáo phân tích CV-JD từ KẾT QUẢ ĐÃ TÍNH dưới đây.
+Giữ nguyên số liệu và danh sách kỹ năng, không tự tính lại.
+
+ĐIỂM PHÙ HỢP: {score_percent}%
+KỸ NĂNG ĐÃ CÓ (cv_skills): {cv_skills}
+KỸ NĂNG KHỚP JD (matched_skills): {matched_skills}
+KỸ NĂNG CẦN BỔ SUNG (missing_skills): {missing_skills}
+KHÓA HỌC TỪ DỮ LIỆU COURSERA:
+{courses}
+
+CV (trích đoạn):
+{cv_excerpt}
+
+JD (trích đoạn):
+{jd_excerpt}
+
+Nếu không có khóa học từ dữ liệu, hãy tự đề xuất 3-5 khóa học từ Coursera, Udemy, hoặc edX cho missing_skills
+(Tên khóa, Nền tảng, Link tìm kiếm, ví dụ: https://www.coursera.org/search?query=python).
+
+Format:
+
+# 📊 KẾT QUẢ PHÂN TÍCH
+
+## 🎯 Điểm Phù Hợp: [ĐIỂM]%
+
+## ✅ Kỹ Năng Đã Có
+[Liệt kê cv_skills]
+
+## ⚠️ Kỹ Năng Cần Bổ Sung
+[Liệt kê missing_skills]
+
+## 📚 Khóa Học Đề Xuất
+[Liệt kê khóa học]
+
+## 💡 Nhận Xét
+[Đánh giá và lời khuyên]
+
+Trả lời bằng tiếng Việt, chuyên nghiệp, thân thiện."""
+
+
+def _load_input_text(data: str, data_type: str) -> str:
+    if data_type == "file":
+        return _extract_file_text(data)
+    return process_raw_text(data)
+
+
+def _recommend_for_missing(skills_future):
+    return get_course_recommendations(skills_future.result()["missing_skills"])
+
+
+def _embed_pair(cv_text: str, jd_text: str):
+    # Cùng text đã encode lúc tính điểm nên lấy lại từ embedding cache, không encode lại
+    if get_sim_model() is None:
+        return None, None
+    cv_embedding, jd_embedding = embed_texts([cv_text, jd_text])
+    return cv_embedding, jd_embedding
+
+
+def _check_extracted(cv_text: str, jd_text: str):
+    for name, text in (("CV", cv_text), ("JD", jd_text)):
+        if not text or text.startswith(("Error", "ERROR")):
+            raise ValueError(f"Không trích xuất được {name}: {text or 'văn bản rỗng'}")
+
+
+def run_analysis_pipeline(cv_input: str, jd_input: str, cv_type: str = "text", jd_type: str = "text",
+                          session_id: str = DEFAULT_SESSION_ID) -> dict:
+    """
+    Các bước xác định của phân tích CV-JD, chạy thẳng bằng code (không qua agent):
+    trích xuất CV || JD, sau đó điểm || kỹ năng -> khóa học.
+    Kết quả được lưu vào session_id. Trả về dict: cv_text, jd_text, score, skills, courses.
+    """
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        cv_future = pool.submit(_load_input_text, cv_input, cv_type)
+        jd_future = pool.submit(_load_input_text, jd_input, jd_type)
+        cv_text, jd_text = cv_future.result(), jd_future.result()
+        _check_extracted(cv_text, jd_text)
+        session_store.set(session_id, replace=True, cv_text=cv_text, jd_text=jd_text)
+
+        score_future = pool.submit(calculate_similarity, cv_text, jd_text)
+        skills_future = pool.submit(compare_skills_tool, cv_text, jd_text)
+        courses_future = pool.submit(_recommend_for_missing, skills_future)
+        results = {
+            "cv_text": cv_text,
+            "jd_text": jd_text,
+            "score": score_future.result(),
+            "skills": skills_future.result(),
+            "courses": courses_future.result(),
+        }
+    cv_embedding, jd_embedding = _embed_pair(cv_text, jd_text)
+    session_store.set(session_id, score=results["score"], skills=results["skills"], courses=results["courses"],
+                      cv_embedding=cv_embedding, jd_embedding=jd_embedding)
+    return results
+
+
+def _report_prompt(results: dict) -> str:
+    skills = results["skills"]
+    courses = "\n".join(f"- {c['course_name']} ({c['url']})" for c in results["courses"]) or "(không có)"
+    return REPORT_PROMPT.format(
+        score_percent=round(results["score"] * 100, 2),
+        cv_skills=", ".join(skills["cv_skills"]) or "(không có)",
+        matched_skills=", ".join(skills["matched_skills"]) or "(không có)",
+        missing_skills=", ".join(skills["missing_skills"]) or "(không có)",
+        courses=courses,
+        cv_excerpt=results["cv_text"][:2000],
+        jd_excerpt=results["jd_text"][:2000],
+    )
+
+
+def _write_report(results: dict) -> str:
+    """Lần gọi LLM duy nhất của pipeline: viết phần báo cáo từ kết quả đã tính."""
+    llm = get_llm()
+    return llm.invoke([HumanMessage(content=_report_prompt(results))]).content
+
+
+def _analysis_query(cv_input: str, jd_input: str, cv_type: str, jd_type: str) -> str:
+    return f"""
 Thực hiện phân tích CV-JD theo 5 BƯỚC ĐƠN GIẢN:
 
 THÔNG TIN:
@@ -298,34 +619,45 @@ CHÚ Ý:
 
 BẮT ĐẦU!
 """
+
+
+def analyze_cv_jd(cv_input: str, jd_input: str, cv_type: str = "text", jd_type: str = "text", mode: str = None,
+                  session_id: str = DEFAULT_SESSION_ID):
+    """Phân tích CV và JD. mode: "pipeline" (mặc định theo ANALYSIS_MODE) hoặc "agent"."""
+    mode = mode or ANALYSIS_MODE
+    if mode not in ANALYSIS_MODES:
+        raise ValueError(f"mode must be one of {ANALYSIS_MODES}, got {mode!r}")
     
-    try:
-        result = agent.invoke({"input": user_query})
-        return result['output']
-    except Exception as e:
-        return f"❌ Lỗi: {str(e)}"
-    
-def find_suitable_jobs():
-    """
-    Tìm việc làm phù hợp với CV đã lưu.
+    session_store.clear(session_id)
     
-    Returns:
-        str: Danh sách việc làm gợi ý
-    """
-    global CV_TEXT_STORAGE
+    print("\n" + "="*70)
+    print("🚀 BẮT ĐẦU PHÂN TÍCH")
+    print("="*70 + "\n")
     
-    if not CV_TEXT_STORAGE:
-        return "❌ Chưa có CV. Vui lòng phân tích CV ở tab 'Phân Tích CV-JD' trước!"
+    if mode == "pipeline":
+        try:
+            return _write_report(run_analysis_pipeline(cv_input, jd_input, cv_type, jd_type, session_id))
+        except Exception as e:
+            return f"❌ Lỗi: {str(e)}"
     
-    print("\n🔍 TÌM VIỆC LÀM PHÙ HỢP...\n")
+    agent = get_agent_executor()
     
-    agent = initialize_agent()
+    user_query = _analysis_query(cv_input, jd_input, cv_type, jd_type)
     
-    query = f"""
+    try:
+        with use_session(session_id):
+            result = agent.invoke({"input": user_query})
+        return result['output']
+    except Exception as e:
+        return f"❌ Lỗi: {str(e)}"
+
+
+def _jobs_query(cv_text: str) -> str:
+    return f"""
 Dựa vào CV đã lưu, hãy gợi ý 5-7 vị trí việc làm PHÙ HỢP NHẤT.
 
 CV:
-{CV_TEXT_STORAGE[:2000]}
+{cv_text[:2000]}
 
 YÊU CẦU:
 - Phân tích kỹ năng, kinh nghiệm, ngành nghề từ CV
@@ -356,33 +688,64 @@ FORMAT:
 ## 💡 Lời Khuyên
 [Gợi ý về hướng phát triển sự nghiệp]
 """
+
+
+def find_suitable_jobs(session_id: str = DEFAULT_SESSION_ID):
+    """
+    Tìm việc làm phù hợp với CV đã lưu.
+    
+    Args:
+        session_id: session chứa CV đã phân tích
+    
+    Returns:
+        str: Danh sách việc làm gợi ý
+    """
+    cv_text = session_store.get(session_id, "cv_text")
+    
+    if not cv_text:
+        return "❌ Chưa có CV. Vui lòng phân tích CV ở tab 'Phân Tích CV-JD' trước!"
+    
+    print("\n🔍 TÌM VIỆC LÀM PHÙ HỢP...\n")
+    
+    agent = get_agent_executor()
+    
+    query = _jobs_query(cv_text)
     
     try:
-        result = agent.invoke({"input": query})
+        with use_session(session_id):
+            result = agent.invoke({"input": query})
         return result['output']
     except Exception as e:
         return f"❌ Lỗi: {str(e)}"
-def chat_with_agent(user_message: str):
+
+
+def _chat_query(user_message: str, session_id: str) -> str:
+    state = session_store.get_all(session_id)
+    context = ""
+    if state.get("cv_text"):
+        context += f"\n[CV đã lưu: {len(state['cv_text'])} ký tự]"
+    if state.get("jd_text"):
+        context += f"\n[JD đã lưu: {len(state['jd_text'])} ký tự]"
+    
+    return f"{context}\n\nCÂU HỎI: {user_message}\n\nHãy trả lời dựa trên thông tin đã lưu (nếu có) và kiến thức của bạn."
+
+
+def chat_with_agent(user_message: str, session_id: str = DEFAULT_SESSION_ID):
     """
     Chat tự do với agent (không lưu history).
     
     Args:
         user_message: Câu hỏi của người dùng
+        session_id: session chứa CV/JD đã lưu
     
     Returns:
         str: Phản hồi của agent
     """
-    agent = initialize_agent()
-    global CV_TEXT_STORAGE, JD_TEXT_STORAGE
-    context = ""
-    if CV_TEXT_STORAGE:
-        context += f"\n[CV đã lưu: {len(CV_TEXT_STORAGE)} ký tự]"
-    if JD_TEXT_STORAGE:
-        context += f"\n[JD đã lưu: {len(JD_TEXT_STORAGE)} ký tự]"
-    
-    full_query = f"{context}\n\nCÂU HỎI: {user_message}\n\nHãy trả lời dựa trên thông tin đã lưu (nếu có) và kiến thức của bạn."
+    agent = get_agent_executor()
+    full_query = _chat_query(user_message, session_id)
     try:
-        result = agent.invoke({"input": full_query})
+        with use_session(session_id):
+            result = agent.invoke({"input": full_query})
         return result['output']
     except Exception as e:
         return f"❌ Lỗi: {str(e)}"
\ No newline at end of file
@@ -0,0 +1,296 @@
+# %%
+import os
+import queue
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import HumanMessage
+from langchain_core.callbacks import AsyncCallbackHandler
+
+from agent import (
+    ANALYSIS_MODE, ANALYSIS_MODES, DEFAULT_SESSION_ID, process_raw_text, calculate_similarity,
+    compare_skills_tool, get_course_recommendations, get_llm, get_agent_executor, session_store,
+    use_session, _extract_file_text, _check_extracted, _embed_pair, _report_prompt, _analysis_query,
+    _jobs_query, _chat_query,
+)
+
+# %%
+ENGINE_MAX_PENDING = int(os.getenv("ENGINE_MAX_PENDING", "64"))          # job chờ + đang chạy tối đa
+ENGINE_SUBMIT_TIMEOUT = float(os.getenv("ENGINE_SUBMIT_TIMEOUT", "30"))  # giây chờ chỗ trống trước khi từ chối
+ENGINE_CPU_WORKERS = int(os.getenv("ENGINE_CPU_WORKERS", str(min(8, os.cpu_count() or 1))))
+# Số việc chạy đồng thời tối đa cho từng loại tài nguyên
+ENGINE_LIMITS = {
+    "llm": int(os.getenv("ENGINE_LLM_CONCURRENCY", "8")),      # request OpenAI
+    "ocr": int(os.getenv("ENGINE_OCR_CONCURRENCY", "2")),      # trích xuất file (OCR đã có pool riêng bên trong)
+    "encode": int(os.getenv("ENGINE_ENCODE_CONCURRENCY", "1")),  # model MiniLM dùng chung
+    "cpu": ENGINE_CPU_WORKERS,                                 # skill / khóa học
+}
+
+
+class EngineBusyError(RuntimeError):
+    """Hàng đợi đã đầy quá ENGINE_SUBMIT_TIMEOUT giây."""
+
+
+class _StreamHandler(AsyncCallbackHandler):
+    """Đẩy token của LLM và tiến trình tool vào asyncio.Queue để engine phát ra dạng event."""
+    def __init__(self, queue):
+        self.queue = queue
+
+    async def on_llm_new_token(self, token, **kwargs):
+        if token:
+            await self.queue.put({"type": "token", "text": token})
+
+    async def on_tool_start(self, serialized, input_str, **kwargs):
+        await self.queue.put({"type": "progress", "text": f"🔧 Đang chạy {serialized.get('name', 'tool')}..."})
+
+    async def on_tool_end(self, output, **kwargs):
+        await self.queue.put({"type": "progress", "text": f"✅ {kwargs.get('name', 'tool')} xong"})
+
+
+_STREAM_END = object()
+
+# %%
+class AnalysisEngine:
+    """
+    Chạy nhiều job phân tích cùng lúc trên MỘT event loop asyncio (thread nền):
+    - LLM gọi bằng ainvoke nên chờ mạng không chiếm thread.
+    - OCR, encode, skill, khóa học chạy trong thread pool, mỗi loại có semaphore giới hạn riêng.
+    - submit() chặn khi đã có max_pending job (backpressure), quá submit_timeout thì báo EngineBusyError.
+    Gọi được từ mọi thread (vd: mỗi phiên Streamlit một thread).
+    """
+    def __init__(self, max_pending=ENGINE_MAX_PENDING, cpu_workers=ENGINE_CPU_WORKERS,
+                 limits=None, submit_timeout=ENGINE_SUBMIT_TIMEOUT):
+        self.limits = {**ENGINE_LIMITS, **(limits or {})}
+        self.max_pending = max_pending
+        self.submit_timeout = submit_timeout
+        self._executor = ThreadPoolExecutor(cpu_workers, thread_name_prefix="engine-cpu")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._loop = asyncio.new_event_loop()
+        self._semaphores = {name: asyncio.Semaphore(n) for name, n in self.limits.items()}
+        self._thread = threading.Thread(target=self._run_loop, name="analysis-engine", daemon=True)
+        self._thread.start()
+        self._counts_lock = threading.Lock()
+        self._counts = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "pending": 0}
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _run_blocking(self, resource, fn, *args):
+        """Chạy hàm đồng bộ trong thread pool, giữ một slot của resource trong lúc chạy."""
+        async with self._semaphores[resource]:
+            ctx = contextvars.copy_context()
+            return await self._loop.run_in_executor(self._executor, ctx.run, fn, *args)
+
+    # ----- các job -----
+    async def _extract(self, data, data_type):
+        if data_type == "file":
+            return await self._run_blocking("ocr", _extract_file_text, data)
+        return process_raw_text(data)
+
+    async def _skills_and_courses(self, cv_text, jd_text):
+        skills = await self._run_blocking("cpu", compare_skills_tool, cv_text, jd_text)
+        courses = await self._run_blocking("cpu", get_course_recommendations, skills["missing_skills"])
+        return skills, courses
+
+    async def _stream_llm(self, call):
+        """
+        Chạy call(handler) (một lần ainvoke với callbacks=[handler]) và phát event trong lúc chờ:
+        token / tiến trình tool ngay khi có, cuối cùng là {"type": "done", "text": kết quả}.
+        Cache hit thì không có token, chỉ có event done.
+        """
+        queue = asyncio.Queue()
+        handler = _StreamHandler(queue)
+        async with self._semaphores["llm"]:
+            task = asyncio.ensure_future(call(handler))
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done:
+                    getter.cancel()
+                    break
+                yield getter.result()
+            while not queue.empty():
+                yield queue.get_nowait()
+            yield {"type": "done", "text": task.result()}
+
+    async def analyze_stream(self, cv_input, jd_input, cv_type="text", jd_type="text",
+                             session_id=DEFAULT_SESSION_ID, mode=None):
+        """
+        Phân tích CV-JD dạng stream. Event: {"type": "progress" | "token" | "done" | "error", "text": ...}.
+        Bước tính toán báo tiến trình, báo cáo được stream theo token.
+        """
+        mode = mode or ANALYSIS_MODE
+        if mode not in ANALYSIS_MODES:
+            raise ValueError(f"mode must be one of {ANALYSIS_MODES}, got {mode!r}")
+        try:
+            session_store.clear(session_id)
+            if mode == "agent":
+                async for event in self._stream_agent(_analysis_query(cv_input, jd_input, cv_type, jd_type), session_id):
+                    yield event
+                return
+
+            yield {"type": "progress", "text": "📄 Đang trích xuất CV và JD..."}
+            cv_text, jd_text = await asyncio.gather(self._extract(cv_input, cv_type), self._extract(jd_input, jd_type))
+            _check_extracted(cv_text, jd_text)
+            session_store.set(session_id, replace=True, cv_text=cv_text, jd_text=jd_text)
+
+            yield {"type": "progress", "text": "🎯 Đang tính điểm phù hợp và so sánh kỹ năng..."}
+            score, (skills, courses) = await asyncio.gather(
+                self._run_blocking("encode", calculate_similarity, cv_text, jd_text),
+                self._skills_and_courses(cv_text, jd_text),
+            )
+            yield {"type": "progress", "text": f"✅ Điểm phù hợp {round(score * 100, 2)}%, "
+                                               f"thiếu {len(skills['missing_skills'])} kỹ năng, {len(courses)} khóa học gợi ý"}
+            results = {"cv_text": cv_text, "jd_text": jd_text, "score": score, "skills": skills, "courses": courses}
+            cv_embedding, jd_embedding = await self._run_blocking("encode", _embed_pair, cv_text, jd_text)
+            session_store.set(session_id, score=score, skills=skills, courses=courses,
+                              cv_embedding=cv_embedding, jd_embedding=jd_embedding)
+
+            yield {"type": "progress", "text": "✍️ Đang viết báo cáo..."}
+            message = HumanMessage(content=_report_prompt(results))
+
+            async def write_report(handler):
+                response = await get_llm(streaming=True).ainvoke([message], config={"callbacks": [handler]})
+                return response.content
+
+            async for event in self._stream_llm(write_report):
+                yield event
+        except Exception as e:
+            yield {"type": "error", "text": f"❌ Lỗi: {str(e)}"}
+
+    async def _stream_agent(self, query, session_id):
+        async def invoke(handler):
+            with use_session(session_id):
+                # Tool của agent (OCR, encode...) chạy qua _run_blocking: cùng thread pool và semaphore với pipeline
+                executor = get_agent_executor(streaming=True, run_blocking=self._run_blocking)
+                result = await executor.ainvoke({"input": query}, config={"callbacks": [handler]})
+            return result['output']
+
+        async for event in self._stream_llm(invoke):
+            yield event
+
+    async def find_jobs_stream(self, session_id=DEFAULT_SESSION_ID):
+        cv_text = session_store.get(session_id, "cv_text")
+        if not cv_text:
+            yield {"type": "error", "text": "❌ Chưa có CV. Vui lòng phân tích CV ở tab 'Phân Tích CV-JD' trước!"}
+            return
+        try:
+            async for event in self._stream_agent(_jobs_query(cv_text), session_id):
+                yield event
+        except Exception as e:
+            yield {"type": "error", "text": f"❌ Lỗi: {str(e)}"}
+
+    async def chat_stream(self, user_message, session_id=DEFAULT_SESSION_ID):
+        try:
+            async for event in self._stream_agent(_chat_query(user_message, session_id), session_id):
+                yield event
+        except Exception as e:
+            yield {"type": "error", "text": f"❌ Lỗi: {str(e)}"}
+
+    @staticmethod
+    async def _final_text(events):
+        text = ""
+        async for event in events:
+            if event["type"] in ("done", "error"):
+                text = event["text"]
+        return text
+
+    async def analyze(self, cv_input, jd_input, cv_type="text", jd_type="text",
+                      session_id=DEFAULT_SESSION_ID, mode=None):
+        """Bản async của agent.analyze_cv_jd (cùng kết quả, cùng session store)."""
+        return await self._final_text(self.analyze_stream(cv_input, jd_input, cv_type, jd_type, session_id, mode))
+
+    async def find_jobs(self, session_id=DEFAULT_SESSION_ID):
+        """Bản async của agent.find_suitable_jobs."""
+        return await self._final_text(self.find_jobs_stream(session_id))
+
+    async def chat(self, user_message, session_id=DEFAULT_SESSION_ID):
+        """Bản async của agent.chat_with_agent."""
+        return await self._final_text(self.chat_stream(user_message, session_id))
+
+    # ----- gửi job từ thread khác -----
+    def _count(self, **deltas):
+        with self._counts_lock:
+            for name, delta in deltas.items():
+                self._counts[name] += delta
+
+    def _on_done(self, future):
+        self._slots.release()
+        failed = future.cancelled() or future.exception() is not None
+        self._count(pending=-1, failed=int(failed), completed=int(not failed))
+
+    def _submit(self, job, args, kwargs, timeout):
+        if not self._slots.acquire(timeout=timeout):
+            self._count(rejected=1)
+            raise EngineBusyError(f"Hệ thống đang bận ({self.max_pending} yêu cầu đang chờ), vui lòng thử lại sau.")
+        self._count(submitted=1, pending=1)
+        future = asyncio.run_coroutine_threadsafe(job(*args, **kwargs), self._loop)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def submit(self, job, *args, **kwargs):
+        """
+        Đưa coroutine job(*args, **kwargs) (vd: engine.analyze) vào event loop.
+        Trả về concurrent.futures.Future; trong code async khác dùng asyncio.wrap_future().
+        """
+        return self._submit(job, args, kwargs, self.submit_timeout)
+
+    def run(self, job, *args, **kwargs):
+        """submit rồi chờ kết quả (dùng trong handler đồng bộ như Streamlit)."""
+        return self.submit(job, *args, **kwargs).result()
+
+    async def _drain(self, events, out):
+        try:
+            async for event in events:
+                out.put(event)
+        finally:
+            out.put(_STREAM_END)
+
+    def stream(self, job, *args, **kwargs):
+        """
+        Bản đồng bộ của một job stream (vd: engine.analyze_stream) cho thread gọi (Streamlit):
+        generator trả về từng event ngay khi engine phát ra.
+        """
+        out = queue.Queue()
+        future = self._submit(self._drain, (job(*args, **kwargs), out), {}, self.submit_timeout)
+        while True:
+            event = out.get()
+            if event is _STREAM_END:
+                break
+            yield event
+        future.result()
+
+    def analyze_many(self, jobs) -> list:
+        """
+        Phân tích nhiều cặp CV/JD cùng lúc; jobs là list dict tham số của analyze.
+        Kết quả đúng thứ tự đầu vào; hàng đợi đầy thì chờ (backpressure).
+        """
+        futures = [self._submit(self.analyze, (), job, None) for job in jobs]
+        return [future.result() for future in futures]
+
+    def stats(self) -> dict:
+        with self._counts_lock:
+            return {**self._counts, "limits": dict(self.limits), "max_pending": self.max_pending}
+
+    def shutdown(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._executor.shutdown(wait=False)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> AnalysisEngine:
+    """Engine dùng chung cho cả process (tạo ở lần gọi đầu tiên)."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = AnalysisEngine()
+    return _engine
+
+# %%
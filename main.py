@@ -1,10 +1,14 @@
 import streamlit as st
 import os
 import tempfile
+import uuid
 from dotenv import load_dotenv
 
 load_dotenv()
-from agent import analyze_cv_jd, find_suitable_jobs, chat_with_agent
+from engine import get_engine
+
+# Engine dùng chung cho mọi phiên: nhiều người dùng chạy song song thay vì xếp hàng từng job
+engine = get_engine()
 
 st.set_page_config(page_title="AI Resume Analyzer", page_icon="🕵️‍♂️", layout="wide")
 
@@ -33,9 +37,29 @@ def save_uploaded_file(uploaded_file):
         st.error(f"Lỗi khi lưu file: {e}")
         return None
 
+def render_stream(events, label):
+    """Hiện tiến trình các bước và token của câu trả lời ngay khi engine phát ra; trả về text cuối cùng."""
+    status = st.status(label, expanded=True)
+    placeholder = st.empty()
+    text = ""
+    for event in events:
+        if event["type"] == "progress":
+            status.write(event["text"])
+        elif event["type"] == "token":
+            text += event["text"]
+            placeholder.markdown(text + "▌")
+        else:
+            text = event["text"]
+    placeholder.empty()
+    status.update(state="error" if text.startswith("❌") else "complete", expanded=False)
+    return text
+
 # Session state cho chatbox
 if "chat_messages" not in st.session_state:
     st.session_state.chat_messages = []
+# Mỗi phiên trình duyệt một session ID: CV/JD của người dùng này không đè lên người khác
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 
 st.title("🕵️‍♂️ AI Resume & Career Analyzer")
 st.caption("Phát triển bởi Võ Phước Thịnh, Liên Phúc Thịnh và Nguyễn Tấn Phúc Thịnh - The Unwithering Trio")
@@ -102,21 +126,23 @@ with tab1:
             st.error("⚠️ Vui lòng cung cấp đầy đủ CV và JD!")
         else:
             try:
-                with st.spinner("🤖 AI đang phân tích... Vui lòng đợi..."):
-                    result = analyze_cv_jd(cv_input=cv_input, jd_input=jd_input, 
-                                          cv_type=cv_type, jd_type=jd_type)
-                    
-                    if "ERROR:" in result or "❌" in result:
-                        st.markdown(f"""
-                        <div class="error-box">
-                        <h3>❌ Lỗi khi xử lý</h3>
-                        <p>{result}</p>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    else:
-                        st.success("✅ Phân tích hoàn tất!")
-                        st.markdown("---")
-                        st.markdown(result)
+                result = render_stream(
+                    engine.stream(engine.analyze_stream, cv_input=cv_input, jd_input=jd_input,
+                                  cv_type=cv_type, jd_type=jd_type,
+                                  session_id=st.session_state.session_id),
+                    "🤖 AI đang phân tích...")
+                
+                if "ERROR:" in result or "❌" in result:
+                    st.markdown(f"""
+                    <div class="error-box">
+                    <h3>❌ Lỗi khi xử lý</h3>
+                    <p>{result}</p>
+                    </div>
+                    """, unsafe_allow_html=True)
+                else:
+                    st.success("✅ Phân tích hoàn tất!")
+                    st.markdown("---")
+                    st.markdown(result)
             except Exception as e:
                 st.error(f"❌ Lỗi: {e}")
             finally:
@@ -139,24 +165,24 @@ with tab2:
     
     with col1:
         if st.button("🔍 TÌM VIỆC PHÙ HỢP NGAY", type="primary", use_container_width=True):
-            with st.spinner("🤖 AI đang phân tích CV và tìm việc phù hợp..."):
-                try:
-                    result = find_suitable_jobs()
+            try:
+                result = render_stream(engine.stream(engine.find_jobs_stream, session_id=st.session_state.session_id),
+                                       "🤖 AI đang phân tích CV và tìm việc phù hợp...")
+                
+                if "❌" in result:
+                    st.markdown(f"""
+                    <div class="warning-box">
+                    <h4>⚠️ Chưa thể tìm việc</h4>
+                    <p>{result}</p>
+                    </div>
+                    """, unsafe_allow_html=True)
+                    
+                    st.info("💡 **Hướng dẫn:** Hãy chuyển sang tab 'Phân Tích CV-JD' và phân tích CV trước!")
+                else:
+                    st.markdown(result)
                     
-                    if "❌" in result:
-                        st.markdown(f"""
-                        <div class="warning-box">
-                        <h4>⚠️ Chưa thể tìm việc</h4>
-                        <p>{result}</p>
-                        </div>
-                        """, unsafe_allow_html=True)
-                        
-                        st.info("💡 **Hướng dẫn:** Hãy chuyển sang tab 'Phân Tích CV-JD' và phân tích CV trước!")
-                    else:
-                        st.markdown(result)
-                        
-                except Exception as e:
-                    st.error(f"❌ Lỗi: {str(e)}")
+            except Exception as e:
+                st.error(f"❌ Lỗi: {str(e)}")
     
     with col2:
         st.markdown("""
@@ -218,18 +244,18 @@ with tab3:
         
         # Gọi agent
         with st.chat_message("assistant"):
-            with st.spinner("Đang suy nghĩ..."):
-                try:
-                    response = chat_with_agent(user_input)
-                    st.markdown(response)
-                    
-                    # Lưu phản hồi
-                    st.session_state.chat_messages.append({"role": "assistant", "content": response})
-                    
-                except Exception as e:
-                    error_msg = f"❌ Lỗi: {str(e)}"
-                    st.error(error_msg)
-                    st.session_state.chat_messages.append({"role": "assistant", "content": error_msg})
+            try:
+                response = render_stream(engine.stream(engine.chat_stream, user_input, session_id=st.session_state.session_id),
+                                         "Đang suy nghĩ...")
+                st.markdown(response)
+                
+                # Lưu phản hồi
+                st.session_state.chat_messages.append({"role": "assistant", "content": response})
+                
+            except Exception as e:
+                error_msg = f"❌ Lỗi: {str(e)}"
+                st.error(error_msg)
+                st.session_state.chat_messages.append({"role": "assistant", "content": error_msg})
         
         # Rerun để cập nhật UI
         st.rerun()
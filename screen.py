@@ -0,0 +1,277 @@
+# %%
+"""
+Sàng lọc CV hàng loạt, không cần UI/LLM:
+trích xuất (tools_ocr) -> điểm (tools_similarity) -> skill gap (tools_skills) -> khóa học (tools_courses).
+
+    python screen.py --cv-dir cvs/ --jd jd.pdf -o results.jsonl
+    python screen.py --manifest jobs.jsonl -o results.parquet --workers 4
+
+Manifest: mỗi dòng một JSON {"id", "cv_path" | "cv_text", "jd_path" | "jd_text", "jd_id"} (id, jd_id tùy chọn;
+thiếu JD thì dùng --jd). Kết quả ghi dần ra file JSONL (checkpoint), chạy lại cùng lệnh thì bỏ qua cặp (CV, JD)
+đã xong; cặp bị lỗi ở lần trước được chạy lại (trừ khi có --no-retry-errors).
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import importlib.util
+from multiprocessing import Pool
+from tools_ocr import cached_extract, extract_text_hybrid_fixed, extract_text_from_image, process_raw_text
+from tools_skills import extract_skills_from_text, _compare_skill_sets
+
+# %%
+CV_EXTENSIONS = (".pdf", ".png", ".jpg", ".jpeg", ".txt")
+SCREEN_BATCH_SIZE = 64
+
+_WORKER_JD_SKILLS = None
+
+
+def extract_document(path: str, dpi=300, lang="eng", min_char=50) -> str:
+    """Đọc một file CV/JD bằng công cụ local (text layer / OCR), dùng chung cache tài liệu với app."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".txt":
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            return process_raw_text(f.read())
+    if ext == ".pdf":
+        # Mỗi process chỉ OCR một trang một lúc: song song nằm ở cấp process
+        return cached_extract(
+            path,
+            lambda p: extract_text_hybrid_fixed(p, dpi=dpi, lang=lang, min_char=min_char, workers=1),
+            method="hybrid", dpi=dpi, lang=lang, min_char=min_char,
+        )
+    return cached_extract(path, lambda p: extract_text_from_image(p, lang=lang), method="image", lang=lang)
+
+
+def _init_screen_worker(jd_skills):
+    global _WORKER_JD_SKILLS
+    _WORKER_JD_SKILLS = jd_skills
+
+
+def _extract_and_compare(job):
+    """Chạy trong process con: trích xuất CV và so skill với JD của job."""
+    record = {"id": job["id"], "cv_path": job.get("cv_path"), "jd_id": job["jd_id"]}
+    try:
+        if "cv_text" in job:
+            text = process_raw_text(job["cv_text"])
+        else:
+            text = extract_document(job["cv_path"])
+        if not text or text.startswith(("Error", "ERROR")):
+            raise ValueError(text or "empty text")
+        skills = _compare_skill_sets(set(extract_skills_from_text(text)), _WORKER_JD_SKILLS[job["jd_id"]])
+        jd_total = len(skills["jd_skills"])
+        record.update(
+            chars=len(text),
+            cv_skills=skills["cv_skills"],
+            matched_skills=skills["matched_skills"],
+            missing_skills=skills["missing_skills"],
+            coverage=round(len(skills["matched_skills"]) / jd_total, 4) if jd_total else 0.0,
+        )
+        return record, text
+    except Exception as e:
+        record["error"] = str(e)
+        return record, None
+
+# %%
+def load_jobs(manifest=None, cv_dir=None, jd=None) -> tuple:
+    """Trả về (jobs, jd_texts): jobs là list dict cho từng CV, jd_texts: jd_id -> text JD đã trích xuất."""
+    default_jd = None
+    if jd:
+        default_jd = {"jd_path": jd} if os.path.exists(jd) else {"jd_text": jd}
+
+    entries = []
+    if manifest:
+        with open(manifest, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    entry = json.loads(line)
+                    entry.setdefault("id", entry.get("cv_path") or f"line-{line_no}")
+                    entries.append(entry)
+    if cv_dir:
+        for name in sorted(os.listdir(cv_dir)):
+            if name.lower().endswith(CV_EXTENSIONS):
+                path = os.path.join(cv_dir, name)
+                entries.append({"id": path, "cv_path": path})
+
+    jobs, jd_texts = [], {}
+    for entry in entries:
+        if "jd_path" not in entry and "jd_text" not in entry:
+            if default_jd is None:
+                raise ValueError(f"CV {entry['id']!r} has no JD; pass --jd or set jd_path/jd_text in the manifest")
+            entry = {**default_jd, **entry}
+        jd_id = entry.get("jd_id") or entry.get("jd_path") or hashlib.sha256(entry["jd_text"].encode("utf-8")).hexdigest()[:16]
+        if jd_id not in jd_texts:
+            # JD ít và dùng lại cho nhiều CV: trích xuất một lần ở process chính
+            jd_text = extract_document(entry["jd_path"]) if "jd_path" in entry else process_raw_text(entry["jd_text"])
+            if not jd_text or jd_text.startswith(("Error", "ERROR")):
+                raise ValueError(f"Cannot extract JD {jd_id!r}: {jd_text or 'empty text'}")
+            jd_texts[jd_id] = jd_text
+        job = {"id": str(entry["id"]), "jd_id": jd_id}
+        if "cv_text" in entry:
+            job["cv_text"] = entry["cv_text"]
+        else:
+            job["cv_path"] = entry["cv_path"]
+        jobs.append(job)
+    return jobs, jd_texts
+
+# %%
+def _read_checkpoint(path, retry_errors=True) -> set:
+    """
+    Các cặp (id, jd_id) đã xử lý trong file checkpoint. Dòng cuối bị ghi dở (crash) thì cắt bỏ;
+    retry_errors=True thì bỏ luôn các bản ghi lỗi khỏi file để cặp đó được chạy lại.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    kept, dropped = [], False
+    with open(path, "rb") as f:
+        for raw in f:
+            # Dòng cuối thiếu '\n' là dòng ghi dở, kể cả khi nó vẫn parse được: giữ lại thì lần ghi sau nối dính vào
+            if not raw.endswith(b"\n"):
+                dropped = True
+                break
+            try:
+                record = json.loads(raw)
+                key = (record["id"], record["jd_id"])
+            except (ValueError, KeyError):
+                dropped = True
+                break
+            if retry_errors and "error" in record:
+                dropped = True
+                continue
+            done.add(key)
+            kept.append(raw)
+    if dropped:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.writelines(kept)
+        os.replace(tmp_path, path)
+    return done
+
+
+def _checkpoint_path(output):
+    return output if output.endswith(".jsonl") else output + ".checkpoint.jsonl"
+
+
+def _score_batch(batch, jd_texts, top_courses, chunked):
+    """Điểm (encode theo lô cho từng JD) và khóa học (một lượt batch) cho các CV đã trích xuất."""
+    from tools_similarity import calculate_similarity_many
+    from tools_courses import get_course_recommendations_many
+
+    ok = [(record, text) for record, text in batch if text is not None]
+    by_jd = {}
+    for record, text in ok:
+        by_jd.setdefault(record["jd_id"], []).append((record, text))
+    for jd_id, items in by_jd.items():
+        scores = calculate_similarity_many([text for _, text in items], jd_texts[jd_id], chunked=chunked)
+        for (record, _), score in zip(items, scores):
+            record["score"] = score
+    if top_courses and ok:
+        courses = get_course_recommendations_many([record["missing_skills"] for record, _ in ok], top_courses)
+        for (record, _), recs in zip(ok, courses):
+            record["courses"] = recs
+    return [record for record, _ in batch]
+
+
+def run_screening(jobs, jd_texts, output, workers=0, batch_size=SCREEN_BATCH_SIZE, top_courses=3,
+                  chunked=False, restart=False, retry_errors=True) -> dict:
+    """
+    Chạy toàn bộ job theo kiểu pipeline: process con trích xuất + so skill, process chính
+    chấm điểm / tìm khóa học theo lô trong khi process con làm tiếp các CV sau.
+    Mỗi lô được ghi (flush + fsync) vào checkpoint JSONL; output .parquet được ghi khi đã xong hết.
+    """
+    checkpoint = _checkpoint_path(output)
+    if restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    done = _read_checkpoint(checkpoint, retry_errors)
+    pending = [job for job in jobs if (job["id"], job["jd_id"]) not in done]
+    print(f"📋 {len(jobs)} CV, {len(done)} đã xong trước đó, còn {len(pending)}")
+
+    jd_skills = {jd_id: set(extract_skills_from_text(text)) for jd_id, text in jd_texts.items()}
+    start = time.time()
+    processed = errors = 0
+
+    def flush(batch, out):
+        nonlocal processed, errors
+        for record in _score_batch(batch, jd_texts, top_courses, chunked):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            errors += "error" in record
+        out.flush()
+        os.fsync(out.fileno())
+        processed += len(batch)
+        rate = processed / max(time.time() - start, 1e-9)
+        print(f"✅ {len(done) + processed}/{len(jobs)} CV ({rate:.1f} CV/s, {errors} lỗi)")
+
+    with open(checkpoint, "a", encoding="utf-8") as out:
+        if workers and workers > 0:
+            pool = Pool(workers, initializer=_init_screen_worker, initargs=(jd_skills,))
+            results = pool.imap_unordered(_extract_and_compare, pending, chunksize=4)
+        else:
+            pool = None
+            _init_screen_worker(jd_skills)
+            results = map(_extract_and_compare, pending)
+        try:
+            batch = []
+            for item in results:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    flush(batch, out)
+                    batch = []
+            if batch:
+                flush(batch, out)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    if not output.endswith(".jsonl"):
+        _write_parquet(checkpoint, output)
+    return {"total": len(jobs), "skipped": len(done), "processed": processed, "errors": errors,
+            "seconds": round(time.time() - start, 2), "output": output}
+
+
+def _write_parquet(checkpoint, output):
+    import pandas as pd
+    df = pd.read_json(checkpoint, lines=True)
+    # Cột list lồng dict (courses) lưu dạng JSON string cho parquet gọn và đọc được ở mọi nơi
+    if "courses" in df:
+        df["courses"] = df["courses"].apply(lambda c: json.dumps(c, ensure_ascii=False) if isinstance(c, list) else None)
+    df.to_parquet(output, index=False)
+
+# %%
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sàng lọc CV hàng loạt (không dùng LLM).")
+    source = parser.add_argument_group("đầu vào")
+    source.add_argument("--manifest", help="file JSONL: id, cv_path|cv_text, jd_path|jd_text, jd_id")
+    source.add_argument("--cv-dir", help="thư mục CV (pdf/png/jpg/jpeg/txt)")
+    source.add_argument("--jd", help="file JD hoặc nội dung JD dùng cho mọi CV chưa có JD")
+    parser.add_argument("-o", "--output", required=True, help="results.jsonl hoặc results.parquet (parquet cần pyarrow)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="số process trích xuất (0 = chạy trong process chính)")
+    parser.add_argument("--batch-size", type=int, default=SCREEN_BATCH_SIZE)
+    parser.add_argument("--top-courses", type=int, default=3, help="số khóa học gợi ý mỗi CV (0 = bỏ qua)")
+    parser.add_argument("--chunked", action="store_true", help="chấm điểm trên toàn bộ CV dài (chia chunk)")
+    parser.add_argument("--restart", action="store_true", help="bỏ checkpoint cũ, chạy lại từ đầu")
+    parser.add_argument("--no-retry-errors", dest="retry_errors", action="store_false",
+                        help="không chạy lại các CV bị lỗi ở lần trước")
+    args = parser.parse_args(argv)
+    if not args.manifest and not args.cv_dir:
+        parser.error("cần --manifest hoặc --cv-dir")
+    if not args.output.endswith((".jsonl", ".parquet")):
+        parser.error("--output phải là .jsonl hoặc .parquet")
+    # Kiểm tra trước khi chạy: thiếu engine parquet thì báo ngay, không đợi tới cuối đợt sàng lọc
+    if args.output.endswith(".parquet") and not any(importlib.util.find_spec(m) for m in ("pyarrow", "fastparquet")):
+        parser.error("output .parquet cần pyarrow (pip install pyarrow) hoặc fastparquet; hoặc dùng .jsonl")
+
+    jobs, jd_texts = load_jobs(args.manifest, args.cv_dir, args.jd)
+    summary = run_screening(jobs, jd_texts, args.output, workers=args.workers, batch_size=args.batch_size,
+                            top_courses=args.top_courses, chunked=args.chunked, restart=args.restart,
+                            retry_errors=args.retry_errors)
+    print(json.dumps(summary, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# %%
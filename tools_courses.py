@@ -1,42 +1,205 @@
 # %%
+import os
+import json
+import pickle
+import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from tools_similarity import embed_texts, get_sim_model
+from tools_text import preprocess_text
+
+# %%
+COURSE_SEARCH_MODES = ("tfidf", "dense", "hybrid")
+COURSE_SEARCH_MODE = os.getenv("COURSE_SEARCH_MODE", "tfidf")
+COURSE_HYBRID_ALPHA = 0.5    # trọng số phần dense trong hybrid
 
 # %%
 class SkillGapAnalyzer:
-    def __init__(self, coursera_dataset_path):
-        self.courses_df = pd.read_csv(coursera_dataset_path)
-        self.vectorizer = TfidfVectorizer(stop_words='english')
-        self._preprocess_courses()
-        
+    def __init__(self, coursera_dataset_path, index_dir=None, rebuild=False, embeddings=False):
+        """embeddings=True: chuẩn bị luôn embedding khóa học cho mode dense / hybrid (lúc khởi động, không phải lúc query)."""
+        self.dataset_path = coursera_dataset_path
+        self.index_dir = index_dir
+        self.course_embeddings = None
+        self._warned_no_embeddings = False
+        if index_dir and not rebuild and self._index_is_fresh():
+            self._load_index()
+        else:
+            self.courses_df = pd.read_csv(coursera_dataset_path)
+            self.vectorizer = TfidfVectorizer(stop_words='english')
+            self._preprocess_courses()
+            if index_dir:
+                self.save_index(index_dir)
+        if embeddings and self.course_embeddings is None:
+            self.build_course_embeddings()
+
     def _preprocess_courses(self):
         self.courses_df['skills_clean'] = self.courses_df.iloc[:, 1].fillna('').astype(str) 
         self.course_vectors = self.vectorizer.fit_transform(self.courses_df['skills_clean'])
+        # Metadata dạng cột (mảng numpy) thay cho DataFrame khi trả kết quả
+        self.course_names = self._column('course_name', 'Unknown')
+        self.course_urls = self._column('course_url', '#')
+        # Text dùng để encode embedding (tên + skills), lưu trong index để không cần CSV
+        self.course_texts = np.array([f"{name}. {skills}" for name, skills in
+                                      zip(self.course_names, self.courses_df['skills_clean'])], dtype=str)
 
-    def recommend_courses(self, missing_skills, top_n=3):
-        if not missing_skills: return []
-        query = ' '.join(missing_skills)
-        query_vector = self.vectorizer.transform([query])
-        similarities = cosine_similarity(query_vector, self.course_vectors).flatten()
-        top_indices = similarities.argsort()[-top_n:][::-1]
-        
-        results = []
-        for idx in top_indices:
-            row = self.courses_df.iloc[idx]
-            results.append({
-                "course_name": row.get('course_name', 'Unknown'),
-                "url": row.get('course_url', '#'),
-                "score": round(similarities[idx], 2)
-            })
+    def _column(self, name, default):
+        if name not in self.courses_df:
+            return np.full(len(self.courses_df), default)
+        return self.courses_df[name].fillna(default).astype(str).to_numpy(dtype=str)
+
+    # ----- index dựng sẵn -----
+    def _source_signature(self):
+        stat = os.stat(self.dataset_path)
+        return {"source": os.path.abspath(self.dataset_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def _index_is_fresh(self):
+        meta_path = os.path.join(self.index_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            return False
+        # Index cũ chưa có course_texts.npy: dựng lại nếu còn CSV
+        if not os.path.exists(os.path.join(self.index_dir, "course_texts.npy")) and os.path.exists(self.dataset_path):
+            return False
+        # Chỉ còn index (không có CSV) thì vẫn dùng index
+        if not os.path.exists(self.dataset_path):
+            return True
+        with open(meta_path) as f:
+            meta = json.load(f)
+        signature = self._source_signature()
+        return meta.get("size") == signature["size"] and meta.get("mtime_ns") == signature["mtime_ns"]
+
+    def save_index(self, index_dir):
+        """Lưu vocabulary, ma trận TF-IDF (sparse) và metadata khóa học ra thư mục index_dir."""
+        os.makedirs(index_dir, exist_ok=True)
+        with open(os.path.join(index_dir, "vectorizer.pkl"), "wb") as f:
+            pickle.dump(self.vectorizer, f, protocol=pickle.HIGHEST_PROTOCOL)
+        sp.save_npz(os.path.join(index_dir, "course_vectors.npz"), self.course_vectors.tocsr(), compressed=False)
+        np.save(os.path.join(index_dir, "course_names.npy"), self.course_names)
+        np.save(os.path.join(index_dir, "course_urls.npy"), self.course_urls)
+        if self.course_texts is not None:
+            np.save(os.path.join(index_dir, "course_texts.npy"), self.course_texts)
+        # Embedding cũ không còn khớp với catalog mới
+        embeddings_path = os.path.join(index_dir, "course_embeddings.npy")
+        if os.path.exists(embeddings_path):
+            os.remove(embeddings_path)
+        # meta.json ghi sau cùng: index chỉ được coi là hợp lệ khi đã ghi đủ file
+        with open(os.path.join(index_dir, "meta.json"), "w") as f:
+            json.dump(self._source_signature(), f)
+
+    def _load_index(self):
+        with open(os.path.join(self.index_dir, "vectorizer.pkl"), "rb") as f:
+            self.vectorizer = pickle.load(f)
+        self.course_vectors = sp.load_npz(os.path.join(self.index_dir, "course_vectors.npz"))
+        self.course_names = np.load(os.path.join(self.index_dir, "course_names.npy"), mmap_mode="r")
+        self.course_urls = np.load(os.path.join(self.index_dir, "course_urls.npy"), mmap_mode="r")
+        texts_path = os.path.join(self.index_dir, "course_texts.npy")
+        self.course_texts = np.load(texts_path, mmap_mode="r") if os.path.exists(texts_path) else None
+        embeddings_path = os.path.join(self.index_dir, "course_embeddings.npy")
+        if os.path.exists(embeddings_path):
+            self.course_embeddings = np.load(embeddings_path, mmap_mode="r")
+
+    @classmethod
+    def build_index(cls, coursera_dataset_path, index_dir, embeddings=True):
+        """Dựng lại index từ CSV (gọi khi catalog thay đổi), mặc định kèm embedding cho dense / hybrid."""
+        return cls(coursera_dataset_path, index_dir=index_dir, rebuild=True, embeddings=embeddings)
+
+    def _top_courses(self, indices, scores, top_n):
+        """Top-N của một hàng kết quả sparse bằng argpartition, hòa điểm thì ưu tiên index nhỏ."""
+        if len(scores) > top_n:
+            part = np.argpartition(-scores, top_n - 1)[:top_n]
+            indices, scores = indices[part], scores[part]
+        order = np.lexsort((indices, -scores))
+        top = list(zip(indices[order].tolist(), scores[order].tolist()))
+        # Không đủ khóa học có điểm > 0 thì bù bằng khóa học điểm 0 như argsort cũ
+        if len(top) < top_n:
+            taken = set(indices.tolist())
+            for idx in range(self.course_vectors.shape[0]):
+                if len(top) >= top_n:
+                    break
+                if idx not in taken:
+                    top.append((idx, 0.0))
+        return top
+
+    def build_course_embeddings(self, batch_size=64):
+        """
+        Encode mọi khóa học (tên + skills) bằng MiniLM một lần, lưu course_embeddings.npy
+        cạnh index để các lần sau chỉ cần memmap. Encode thẳng bằng model, không qua embedding_cache
+        (cả catalog chỉ encode một lần, không nên đẩy embedding của CV / JD ra khỏi cache).
+        """
+        if self.course_texts is None:
+            print("⚠️ Course index has no course_texts.npy, cannot build embeddings; rebuild it with SkillGapAnalyzer.build_index().")
+            return None
+        model = get_sim_model()
+        if model is None:
+            return None
+        texts = [preprocess_text(str(t)) for t in self.course_texts]
+        embeddings = model.encode(texts, batch_size=batch_size, convert_to_numpy=True,
+                                  normalize_embeddings=True).astype(np.float32)
+        if self.index_dir:
+            embeddings_path = os.path.join(self.index_dir, "course_embeddings.npy")
+            np.save(embeddings_path, embeddings)
+            embeddings = np.load(embeddings_path, mmap_mode="r")
+        self.course_embeddings = embeddings
+        return embeddings
+
+    def recommend_courses_many(self, missing_skills_list, top_n=3, mode="tfidf", alpha=COURSE_HYBRID_ALPHA):
+        """
+        Gợi ý khóa học cho nhiều danh sách kỹ năng thiếu cùng lúc:
+        một phép nhân sparse cho cả batch, top-N bằng argpartition, kết quả lấy từ mảng cột.
+        mode: "tfidf" (trùng từ), "dense" (ngữ nghĩa, embedding MiniLM), "hybrid" (alpha * dense + (1 - alpha) * tfidf).
+        """
+        if mode not in COURSE_SEARCH_MODES:
+            raise ValueError(f"mode must be one of {COURSE_SEARCH_MODES}, got {mode!r}")
+        results = [[] for _ in missing_skills_list]
+        active = [i for i, skills in enumerate(missing_skills_list) if skills]
+        if not active:
+            return results
+
+        queries = [' '.join(missing_skills_list[i]) for i in active]
+        if mode != "tfidf" and self.course_embeddings is None:
+            # Không encode cả catalog giữa một request: dùng TF-IDF cho tới khi index có embedding
+            if not self._warned_no_embeddings:
+                print(f"⚠️ Course embeddings not built, using 'tfidf' instead of {mode!r} "
+                      f"(build them with SkillGapAnalyzer.build_index or embeddings=True).")
+                self._warned_no_embeddings = True
+            mode = "tfidf"
+        if mode != "dense":
+            query_vectors = self.vectorizer.transform(queries)
+            # TF-IDF đã chuẩn hóa L2 nên cosine = tích vô hướng
+            similarities = (query_vectors @ self.course_vectors.T).tocsr()
+        if mode != "tfidf":
+            dense = embed_texts(queries) @ np.asarray(self.course_embeddings).T
+            all_courses = np.arange(dense.shape[1])
+
+        for row, i in enumerate(active):
+            if mode != "dense":
+                start, end = similarities.indptr[row], similarities.indptr[row + 1]
+                indices, scores = similarities.indices[start:end], similarities.data[start:end]
+            if mode == "dense":
+                indices, scores = all_courses, dense[row]
+            elif mode == "hybrid":
+                hybrid = alpha * dense[row]
+                hybrid[indices] += (1 - alpha) * scores
+                indices, scores = all_courses, hybrid
+            top = self._top_courses(indices, scores, top_n)
+            results[i] = [{
+                "course_name": str(self.course_names[idx]),
+                "url": str(self.course_urls[idx]),
+                "score": round(score, 2)
+            } for idx, score in top]
         return results
 
+    def recommend_courses(self, missing_skills, top_n=3, mode="tfidf"):
+        if not missing_skills: return []
+        return self.recommend_courses_many([missing_skills], top_n, mode)[0]
 
 # %%
 DATASET_PATH = "D:\CS311 Project\data\coursea_data.csv" 
+COURSE_INDEX_DIR = os.getenv("COURSE_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "course_index"))
 print("Loading Course Analyzer...")
 try:
-    course_analyzer = SkillGapAnalyzer(DATASET_PATH)
+    course_analyzer = SkillGapAnalyzer(DATASET_PATH, index_dir=COURSE_INDEX_DIR,
+                                       embeddings=COURSE_SEARCH_MODE != "tfidf")
     print("✅ Course Analyzer loaded.")
 except Exception as e:
     print(f"⚠️ Error loading Course Data: {e}")
@@ -47,6 +210,11 @@ def get_course_recommendations(missing_skills: list) -> list:
     """Tool gợi ý khóa học dựa trên list kỹ năng thiếu."""
     if course_analyzer is None:
         return []
-    return course_analyzer.recommend_courses(missing_skills)
+    return course_analyzer.recommend_courses(missing_skills, mode=COURSE_SEARCH_MODE)
 
 
+def get_course_recommendations_many(missing_skills_list: list, top_n: int = 3) -> list:
+    """Bản batch của get_course_recommendations (ví dụ cho cả một đợt ứng viên)."""
+    if course_analyzer is None:
+        return [[] for _ in missing_skills_list]
+    return course_analyzer.recommend_courses_many(missing_skills_list, top_n, mode=COURSE_SEARCH_MODE)
@@ -0,0 +1,226 @@
+# %%
+import os
+import json
+import numpy as np
+from tools_similarity import embed_texts, MODEL_PATH
+
+# %%
+class CVIndex:
+    """
+    Kho embedding CV để lấy top-K CV hợp nhất với một JD.
+    - backend "exact": quét toàn bộ bằng một phép nhân ma trận NumPy.
+    - backend "ivf": chia vector vào n_lists cụm (k-means), chỉ quét n_probe cụm gần JD nhất.
+    Xóa là đánh dấu (tombstone), compact() mới thực sự dọn. Lưu/đọc thư mục, đọc bằng memmap.
+    Vector nằm trong buffer tăng dung lượng gấp đôi khi đầy, hàng mới của mỗi cụm IVF gom trong list
+    Python: thêm từng CV một vẫn là O(1) khấu hao thay vì chép lại toàn bộ mảng mỗi lần.
+    """
+    def __init__(self, dim=None, backend="exact", n_lists=256, n_probe=8):
+        if backend not in ("exact", "ivf"):
+            raise ValueError(f"backend must be 'exact' or 'ivf', got {backend!r}")
+        self.dim = dim
+        self.backend = backend
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.ids = []
+        self._row_of = {}
+        self._vectors = np.empty((0, dim or 0), dtype=np.float32)
+        self._deleted = np.empty(0, dtype=bool)
+        self._centroids = None
+        self._lists = None
+        self._list_tails = None    # list_id -> hàng mới thêm, chưa gộp vào self._lists
+
+    def __len__(self):
+        return len(self._row_of)
+
+    # _vectors / _deleted là phần đang dùng của buffer (view), phần còn lại để dành cho add
+    @property
+    def _vectors(self):
+        return self._vector_buffer[:self._size]
+
+    @_vectors.setter
+    def _vectors(self, value):
+        self._vector_buffer = value
+        self._size = len(value)
+
+    @property
+    def _deleted(self):
+        return self._deleted_buffer[:self._size]
+
+    @_deleted.setter
+    def _deleted(self, value):
+        self._deleted_buffer = value
+
+    def _reserve(self, n_rows):
+        """Bảo đảm buffer chứa được n_rows hàng; buffer memmap (chỉ đọc) được chép sang RAM ở lần add đầu."""
+        if n_rows <= len(self._vector_buffer) and self._vector_buffer.flags.writeable:
+            return
+        capacity = max(n_rows, 2 * len(self._vector_buffer), 16)
+        vectors = np.empty((capacity, self.dim), dtype=np.float32)
+        vectors[:self._size] = self._vector_buffer[:self._size]
+        deleted = np.zeros(capacity, dtype=bool)
+        deleted[:self._size] = self._deleted_buffer[:self._size]
+        self._vector_buffer, self._deleted_buffer = vectors, deleted
+
+    def _merge_list(self, list_id):
+        tail = self._list_tails.pop(list_id, None)
+        if tail:
+            self._lists[list_id] = np.concatenate([self._lists[list_id], np.array(tail, dtype=self._lists[list_id].dtype)])
+        return self._lists[list_id]
+
+    # ----- thêm / xóa -----
+    def add(self, ids, texts=None, vectors=None, batch_size=32):
+        """Thêm CV theo id; id đã có (kể cả lặp lại trong cùng batch) thì bản sau cùng được giữ."""
+        ids = [str(i) for i in ids]
+        keep = sorted({cv_id: k for k, cv_id in enumerate(ids)}.values())
+        if len(keep) < len(ids):
+            ids = [ids[k] for k in keep]
+            if vectors is not None:
+                vectors = np.asarray(vectors, dtype=np.float32)[keep]
+            else:
+                texts = [texts[k] for k in keep]
+        if vectors is None:
+            vectors = embed_texts(texts, batch_size)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._vectors = self._vectors.reshape(0, self.dim)
+        self.delete([i for i in ids if i in self._row_of])
+
+        start = self._size
+        self._reserve(start + len(ids))
+        self._vector_buffer[start:start + len(ids)] = vectors
+        self._deleted_buffer[start:start + len(ids)] = False
+        self._size = start + len(ids)
+        self.ids.extend(ids)
+        for offset, cv_id in enumerate(ids):
+            self._row_of[cv_id] = start + offset
+
+        if self._centroids is not None:
+            assign = np.argmax(vectors @ self._centroids.T, axis=1)
+            for offset, list_id in enumerate(assign.tolist()):
+                self._list_tails.setdefault(list_id, []).append(start + offset)
+
+    def delete(self, ids):
+        for cv_id in ids:
+            row = self._row_of.pop(str(cv_id), None)
+            if row is not None:
+                self._deleted[row] = True
+
+    def compact(self):
+        """Bỏ hẳn các hàng đã xóa và dựng lại IVF (nếu có)."""
+        keep = np.flatnonzero(~self._deleted)
+        self.ids = [self.ids[r] for r in keep]
+        self._vectors = np.ascontiguousarray(self._vectors[keep])
+        self._deleted = np.zeros(len(keep), dtype=bool)
+        self._row_of = {cv_id: r for r, cv_id in enumerate(self.ids)}
+        if self._centroids is not None:
+            self._assign_lists()
+
+    # ----- IVF -----
+    def train(self, n_iter=10, sample_size=50000, seed=0):
+        """K-means spherical trên một mẫu vector để dựng n_lists cụm cho backend ivf."""
+        live = np.flatnonzero(~self._deleted)
+        rng = np.random.default_rng(seed)
+        sample = self._vectors[rng.choice(live, size=min(sample_size, len(live)), replace=False)]
+        n_lists = min(self.n_lists, len(sample))
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for k in range(n_lists):
+                members = sample[assign == k]
+                if len(members):
+                    centroids[k] = members.sum(axis=0)
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        self._centroids = centroids.astype(np.float32)
+        self._assign_lists()
+
+    def _assign_lists(self, chunk=65536):
+        assign = np.empty(len(self._vectors), dtype=np.int32)
+        for start in range(0, len(self._vectors), chunk):
+            block = self._vectors[start:start + chunk]
+            assign[start:start + chunk] = np.argmax(block @ self._centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(len(self._centroids) + 1))
+        self._lists = [order[bounds[k]:bounds[k + 1]] for k in range(len(self._centroids))]
+        self._list_tails = {}
+
+    # ----- truy vấn -----
+    def search(self, query, top_k=50, n_probe=None):
+        """
+        query: text JD hoặc vector đã chuẩn hóa.
+        Trả về list (cv_id, score) xếp giảm dần.
+        """
+        if isinstance(query, str):
+            query = embed_texts([query])[0]
+        query = np.asarray(query, dtype=np.float32)
+
+        if self.backend == "ivf" and self._centroids is not None:
+            probe = np.argsort(-(self._centroids @ query))[:n_probe or self.n_probe]
+            rows = np.concatenate([self._merge_list(k) for k in probe])
+            rows = rows[~self._deleted[rows]]
+        else:
+            rows = None
+
+        candidates = self._vectors if rows is None else self._vectors[rows]
+        scores = candidates @ query
+        if rows is None:
+            scores[self._deleted] = -np.inf
+        top_k = min(top_k, len(scores))
+        if top_k <= 0:
+            return []
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        top = top[np.isfinite(scores[top])]
+        if rows is not None:
+            return [(self.ids[rows[i]], round(float(scores[i]), 4)) for i in top]
+        return [(self.ids[i], round(float(scores[i]), 4)) for i in top]
+
+    # ----- lưu / đọc -----
+    @staticmethod
+    def _write(path, name, writer):
+        # Ghi ra file tạm rồi os.replace: index đang load bằng memmap từ chính thư mục này
+        # (load -> delete -> save) thì file cũ không bị cắt trong lúc còn đang được đọc
+        target = os.path.join(path, name)
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            writer(f)
+        os.replace(tmp_path, target)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        self._write(path, "vectors.npy", lambda f: np.save(f, self._vectors))
+        self._write(path, "deleted.npy", lambda f: np.save(f, self._deleted))
+        self._write(path, "ids.json", lambda f: f.write(json.dumps(self.ids).encode("utf-8")))
+        meta = {"model": MODEL_PATH, "dim": self.dim, "backend": self.backend,
+                "n_lists": self.n_lists, "n_probe": self.n_probe}
+        self._write(path, "meta.json", lambda f: f.write(json.dumps(meta).encode("utf-8")))
+        ivf_path = os.path.join(path, "ivf.npz")
+        if self._centroids is not None:
+            for list_id in list(self._list_tails):
+                self._merge_list(list_id)
+            sizes = np.array([len(rows) for rows in self._lists])
+            self._write(path, "ivf.npz", lambda f: np.savez(f, centroids=self._centroids,
+                                                             rows=np.concatenate(self._lists), sizes=sizes))
+        elif os.path.exists(ivf_path):
+            os.remove(ivf_path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Đọc index; mmap=True thì vector được map từ đĩa, không nạp hết vào RAM."""
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        index = cls(meta["dim"], meta["backend"], meta["n_lists"], meta["n_probe"])
+        index._vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r" if mmap else None)
+        index._deleted = np.load(os.path.join(path, "deleted.npy"))
+        with open(os.path.join(path, "ids.json"), encoding="utf-8") as f:
+            index.ids = json.load(f)
+        index._row_of = {cv_id: r for r, cv_id in enumerate(index.ids) if not index._deleted[r]}
+        ivf_path = os.path.join(path, "ivf.npz")
+        if os.path.exists(ivf_path):
+            data = np.load(ivf_path)
+            index._centroids = data["centroids"]
+            index._lists = np.split(data["rows"], np.cumsum(data["sizes"])[:-1])
+            index._list_tails = {}
+        return index
+
+# %%
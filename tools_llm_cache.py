@@ -0,0 +1,135 @@
+# %%
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+# %%
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "llm_cache.sqlite"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+
+# %%
+class SQLiteLLMCache(BaseCache):
+    """
+    Cache câu trả lời LLM trong một file SQLite (dùng cho ChatOpenAI(cache=...)).
+    Key = sha256(llm_string + prompt): llm_string gồm model, tham số và schema tool được bind,
+    prompt là toàn bộ message đã serialize (kể cả tool call / kết quả tool và ảnh base64 của vision).
+    Entry quá ttl giây thì bỏ; tổng dung lượng vượt max_bytes thì xóa entry lâu chưa dùng nhất.
+    """
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, kind TEXT, value TEXT, size INTEGER, created REAL, accessed REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache(accessed)")
+        with self._conn:
+            self._conn.execute("DELETE FROM llm_cache WHERE created < ?", (time.time() - ttl,))
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        self._counts = {kind: {"hits": 0, "misses": 0} for kind in ("text", "vision")}
+        self.expired = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _kind(prompt: str) -> str:
+        return "vision" if '"image_url"' in prompt else "text"
+
+    def lookup(self, prompt: str, llm_string: str):
+        key, kind = self.key(prompt, llm_string), self._kind(prompt)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, size, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[2] > self.ttl:
+                with self._conn:
+                    self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._bytes -= row[1]
+                self.expired += 1
+                row = None
+            if row is None:
+                self._counts[kind]["misses"] += 1
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+            self._counts[kind]["hits"] += 1
+        return [loads(generation) for generation in json.loads(row[0])]
+
+    def update(self, prompt: str, llm_string: str, return_val) -> None:
+        key = self.key(prompt, llm_string)
+        value = json.dumps([dumps(generation) for generation in return_val])
+        size = len(value.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, self._kind(prompt), value, size, now, now),
+                )
+            self._bytes += size - (old[0] if old else 0)
+            self._evict()
+
+    def _evict(self):
+        if self._bytes <= self.max_bytes:
+            return
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed"):
+            if self._bytes <= self.max_bytes:
+                break
+            victims.append((key,))
+            self._bytes -= size
+        with self._conn:
+            self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def clear(self, **kwargs) -> None:
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM llm_cache")
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Hit rate tổng và theo loại (text / vision), số entry, dung lượng, số entry bị bỏ."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            by_kind = {}
+            for kind, counts in self._counts.items():
+                lookups = counts["hits"] + counts["misses"]
+                by_kind[kind] = {**counts, "hit_rate": round(counts["hits"] / lookups, 4) if lookups else 0.0}
+            hits = sum(c["hits"] for c in self._counts.values())
+            lookups = hits + sum(c["misses"] for c in self._counts.values())
+            return {
+                "hits": hits,
+                "misses": lookups - hits,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "by_kind": by_kind,
+                "entries": entries,
+                "bytes": self._bytes,
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
+
+
+llm_cache = None
+if LLM_CACHE_ENABLED:
+    try:
+        llm_cache = SQLiteLLMCache()
+    except (OSError, sqlite3.Error) as e:
+        print(f"⚠️ LLM cache disabled: {e}")
+
+# %%
@@ -1,5 +1,4 @@
 # %%
-import re
 import pymupdf
 import pytesseract
 from pdf2image import convert_from_path
@@ -7,6 +6,13 @@ from PIL import Image
 import platform
 import shutil
 import os
+import json
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+# Làm sạch text dùng chung với tools_similarity (pattern biên dịch sẵn, một lượt qua các dòng)
+from tools_text import clean_extracted_text
 # %%
 if platform.system() == "Windows":
     tesseract_path = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
@@ -18,68 +24,193 @@ else:
         pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
     else:
         pytesseract.pytesseract.tesseract_cmd = "/usr/bin/tesseract"
-# %%   
-def clean_extracted_text(text):
-    if not text: return ""
-    page_patterns = [
-        r'(?i)page\s+\d+(?:\s+of\s+\d+)?',
-        r'(?i)página\s+\d+',
-        r'^\s*\d+\s*$',
-        r'(?i)page\s*\|\s*\d+',
-        r'(?i)\d+\s*/\s*\d+',
-        r'(?i)\d+\s+of\s+\d+',
-    ]
-    lines = text.split('\n')
-    cleaned_lines = []
-    for line in lines:
-        original_line = line
-        line = line.strip()
-        if not line: continue
-        is_page_marker = False
-        for pattern in page_patterns:
-            if re.match(pattern, line):
-                is_page_marker = True
+
+# Số trang/ảnh OCR song song (mỗi lần gọi tesseract là một subprocess riêng)
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+DOC_CACHE_DIR = os.getenv("DOC_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "documents"))
+DOC_CACHE_MAX_BYTES = int(os.getenv("DOC_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+# Trang OCR có điểm chất lượng dưới ngưỡng này mới phải gửi cho model vision
+VISION_QUALITY_THRESHOLD = 0.7
+VISION_DPI = 150
+# Trang có tỉ lệ điểm ảnh tối dưới ngưỡng này coi như trang trắng, không gửi vision
+VISION_MIN_INK = 0.002
+# %%
+class DocumentTextCache:
+    """
+    Cache text đã trích xuất theo nội dung file: key = sha256(bytes của file + cấu hình trích xuất).
+    Mỗi entry là một file <key>.txt; tổng dung lượng vượt max_bytes thì xóa entry lâu chưa dùng nhất.
+    """
+    def __init__(self, cache_dir, max_bytes=DOC_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(file_path, **settings) -> str:
+        """settings: dpi, lang, method... cấu hình khác nhau thì key khác nhau."""
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".txt")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+            os.utime(path)    # đánh dấu vừa dùng cho LRU
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return text
+
+    def put(self, key, text):
+        tmp_path = self._path(key) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".txt"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
                 break
-        if not is_page_marker:
-            cleaned_line = re.sub(r'\s+', ' ', line)
-            cleaned_lines.append(cleaned_line)
-    result = '\n'.join(cleaned_lines)
-    result = re.sub(r'\n{3,}', '\n\n', result)
-    return result.strip()
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
+
 
+def cached_extract(file_path, extract_fn, **settings):
+    """
+    Gọi extract_fn(file_path) qua doc_text_cache. Kết quả rỗng hoặc lỗi thì không lưu.
+    settings phải chứa mọi tham số ảnh hưởng tới kết quả (method, dpi, lang...).
+    """
+    if doc_text_cache is None:
+        return extract_fn(file_path)
+    key = doc_text_cache.key(file_path, **settings)
+    text = doc_text_cache.get(key)
+    if text is None:
+        text = extract_fn(file_path)
+        if text and not text.startswith(("Error", "ERROR")):
+            doc_text_cache.put(key, text)
+    return text
+
+
+try:
+    doc_text_cache = DocumentTextCache(DOC_CACHE_DIR)
+except OSError as e:
+    print(f"⚠️ Document cache disabled: {e}")
+    doc_text_cache = None
 # %%
-def extract_text_hybrid_fixed(pdf_path, dpi=300, lang="eng", min_char=50):
+def render_page_image(page, dpi=300, pdf_path=None):
+    """Render MỘT trang ra ảnh PIL bằng PyMuPDF; lỗi thì thử pdf2image cho riêng trang đó."""
     try:
-        doc = pymupdf.open(pdf_path)
-        text_output = ""
-        # Convert PDF to images for OCR fallback
+        pix = page.get_pixmap(dpi=dpi, colorspace=pymupdf.csRGB, alpha=False)
+        return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    except Exception:
+        if pdf_path is None:
+            return None
         try:
-            images = convert_from_path(pdf_path, dpi=dpi)
+            images = convert_from_path(pdf_path, dpi=dpi, first_page=page.number + 1, last_page=page.number + 1)
+            return images[0] if images else None
         except Exception:
-            images = [] # Handle case where poppler is not installed
-            
+            return None # Handle case where poppler is not installed
+
+# %%
+def _page_text_layer(page):
+    blocks = page.get_text("blocks")
+    if not blocks:
+        return ""
+    blocks = sorted(blocks, key=lambda b: (b[1], b[0]))
+    block_texts = []
+    for block in blocks:
+        block_content = block[4].strip()
+        if block_content:
+            block_texts.append(block_content)
+    return '\n'.join(block_texts)
+
+
+def _ocr_image(image, lang="eng"):
+    try:
+        return pytesseract.image_to_string(image, lang=lang)
+    finally:
+        image.close()
+
+
+def _limit_tesseract_threads(workers):
+    # Nhiều tesseract chạy song song thì mỗi process chỉ nên dùng 1 thread, tránh tranh CPU
+    if workers > 1:
+        os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+# %%
+def iter_pdf_pages(pdf_path, dpi=300, lang="eng", min_char=50, workers=OCR_WORKERS):
+    """
+    Generator trả từng trang theo đúng thứ tự: {"page": số trang (từ 1), "method": "text" | "ocr", "text": text đã làm sạch}.
+    Trang có text layer được trả ngay; trang cần OCR chạy song song phía sau, nên bên dùng có thể
+    xử lý trang 1 trong khi các trang sau vẫn đang OCR. Lỗi mở/đọc PDF được raise cho bên gọi.
+    """
+    workers = max(1, workers)
+    _limit_tesseract_threads(workers)
+    doc = pymupdf.open(pdf_path)
+    pool = ThreadPoolExecutor(max_workers=workers)
+    # (page_num, method, text hoặc Future) theo thứ tự trang, chờ được trả ra
+    queue = deque()
+
+    def ready_pages(block=False):
+        while queue and (block or not isinstance(queue[0][2], Future) or queue[0][2].done()):
+            page_num, method, result = queue.popleft()
+            text = result.result() if isinstance(result, Future) else result
+            yield {"page": page_num + 1, "method": method, "text": clean_extracted_text(text)}
+
+    try:
         for page_num, page in enumerate(doc):
-            page_text = ""
-            blocks = page.get_text("blocks")
-            if blocks:
-                blocks = sorted(blocks, key=lambda b: (b[1], b[0]))
-                block_texts = []
-                for block in blocks:
-                    block_content = block[4].strip()
-                    if block_content:
-                        block_texts.append(block_content)
-                page_text = '\n'.join(block_texts)
-            
+            page_text = _page_text_layer(page)
             if len(page_text.strip()) >= min_char:
-                text_output += page_text + "\n\n"
+                queue.append((page_num, "text", page_text))
             else:
-                # OCR Fallback
-                if page_num < len(images):
-                    ocr_text = pytesseract.image_to_string(images[page_num], lang=lang)
-                    if ocr_text.strip():
-                        text_output += ocr_text + "\n\n"
+                # OCR Fallback: chỉ render trang này, khi cần; giới hạn số ảnh đang chờ OCR trong RAM
+                pending = [item[2] for item in queue if isinstance(item[2], Future) and not item[2].done()]
+                if len(pending) >= 2 * workers:
+                    wait(pending, return_when=FIRST_COMPLETED)
+                image = render_page_image(page, dpi=dpi, pdf_path=pdf_path)
+                queue.append((page_num, "ocr", pool.submit(_ocr_image, image, lang) if image is not None else ""))
+            yield from ready_pages()
+        yield from ready_pages(block=True)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
         doc.close()
-        return clean_extracted_text(text_output)
+
+
+def extract_text_hybrid_fixed(pdf_path, dpi=300, lang="eng", min_char=50, workers=OCR_WORKERS):
+    try:
+        # clean_extracted_text bỏ mọi dòng trống nên làm sạch từng trang rồi nối bằng '\n' cho kết quả như cũ
+        pages = iter_pdf_pages(pdf_path, dpi=dpi, lang=lang, min_char=min_char, workers=workers)
+        return '\n'.join(page["text"] for page in pages if page["text"])
     except Exception as e:
         print(f"Error processing PDF: {e}")
         return ""
@@ -101,10 +232,86 @@ def categorize_resume_text(text):
 def extract_text_from_image(image_path: str, lang="eng") -> str:
     try:
         img = Image.open(image_path)
-        text = pytesseract.image_to_string(img, lang=lang)
+        text = _ocr_image(img, lang=lang)
         return clean_extracted_text(text)
     except Exception as e:
         return f"Error reading image: {str(e)}"
+
+
+def extract_text_from_images(image_paths, lang="eng", workers=OCR_WORKERS) -> list:
+    """OCR nhiều ảnh song song (tối đa `workers` tesseract cùng lúc), kết quả giữ đúng thứ tự đầu vào."""
+    workers = max(1, workers)
+    _limit_tesseract_threads(workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda path: extract_text_from_image(path, lang=lang), image_paths))
+# %%
+_GOOD_SYMBOLS = set(".,;:!?()-/@+#&%'\"•–—")
+
+
+def text_quality(text: str) -> float:
+    """
+    Điểm 0..1 cho text của một trang: tỉ lệ ký tự là chữ/số/khoảng trắng/dấu câu thường gặp.
+    OCR rác (nhiều ký tự lạ) thì thấp; text ngắn nhưng sạch vẫn được điểm cao.
+    """
+    stripped = (text or "").strip()
+    if not stripped or stripped.startswith("Error"):
+        return 0.0
+    good = sum(ch.isalnum() or ch.isspace() or ch in _GOOD_SYMBOLS for ch in stripped)
+    return good / len(stripped)
+
+
+def ink_ratio(image) -> float:
+    """Tỉ lệ điểm ảnh tối (< 128 sau khi chuyển xám) của ảnh trang; gần 0 là trang trắng."""
+    histogram = image.convert("L").histogram()
+    return sum(histogram[:128]) / max(1, image.width * image.height)
+
+
+def extract_text_routed(file_path, vision_fn=None, quality_threshold=VISION_QUALITY_THRESHOLD,
+                        dpi=300, lang="eng", min_char=50, vision_dpi=VISION_DPI, workers=OCR_WORKERS):
+    """
+    Trích xuất theo thứ tự rẻ -> đắt: text layer PyMuPDF -> Tesseract -> vision_fn.
+    vision_fn(image PIL) -> str chỉ được gọi cho các trang OCR không đạt quality_threshold
+    mà vẫn có nội dung (ink_ratio >= VISION_MIN_INK, trang trắng thì bỏ qua), và chỉ nhận ảnh của đúng trang đó.
+    Trả về (text, stats) với stats = số trang theo từng cách {"text", "ocr", "vision"}.
+    """
+    stats = {"text": 0, "ocr": 0, "vision": 0}
+    if not file_path.lower().endswith(".pdf"):
+        text = extract_text_from_image(file_path, lang=lang)
+        if vision_fn is not None and text_quality(text) < quality_threshold:
+            with Image.open(file_path) as image:
+                image = image.convert("RGB")
+                if ink_ratio(image) >= VISION_MIN_INK:
+                    stats["vision"] = 1
+                    return clean_extracted_text(vision_fn(image)), stats
+        stats["ocr"] = 1
+        return text, stats
+
+    pages = list(iter_pdf_pages(file_path, dpi=dpi, lang=lang, min_char=min_char, workers=workers))
+    weak = []
+    if vision_fn is not None:
+        weak = [page for page in pages
+                if page["method"] == "ocr" and text_quality(page["text"]) < quality_threshold]
+    if weak:
+        doc = pymupdf.open(file_path)
+        try:
+            # Render tuần tự (PyMuPDF không thread-safe), gọi vision song song vì chỉ chờ mạng
+            images = [render_page_image(doc[page["page"] - 1], dpi=vision_dpi) for page in weak]
+        finally:
+            doc.close()
+        # Trang (gần như) trắng: giữ kết quả OCR, không tốn một lần gọi vision
+        inked = [(page, image) for page, image in zip(weak, images)
+                 if image is not None and ink_ratio(image) >= VISION_MIN_INK]
+        weak, images = [page for page, _ in inked], [image for _, image in inked]
+    if weak:
+        with ThreadPoolExecutor(max_workers=min(len(weak), 4)) as pool:
+            texts = list(pool.map(vision_fn, images))
+        for page, text in zip(weak, texts):
+            page["text"] = clean_extracted_text(text)
+            page["method"] = "vision"
+    for page in pages:
+        stats[page["method"]] += 1
+    return '\n'.join(page["text"] for page in pages if page["text"]), stats
+
 # %%
 def process_raw_text(text: str) -> str:
     if not text:
@@ -112,8 +319,12 @@ def process_raw_text(text: str) -> str:
     return clean_extracted_text(text)
 # %%
 
-def get_resume_text(pdf_path: str) -> str:
-    """Tool dùng để đọc text từ file PDF."""
-    return extract_text_hybrid_fixed(pdf_path)
+def get_resume_text(pdf_path: str, dpi=300, lang="eng", min_char=50) -> str:
+    """Tool dùng để đọc text từ file PDF (file đã đọc rồi thì lấy từ cache)."""
+    return cached_extract(
+        pdf_path,
+        lambda path: extract_text_hybrid_fixed(path, dpi=dpi, lang=lang, min_char=min_char),
+        method="hybrid", dpi=dpi, lang=lang, min_char=min_char,
+    )
 
 
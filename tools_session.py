@@ -0,0 +1,237 @@
+# %%
+import os
+import time
+import pickle
+import hashlib
+import tempfile
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import OrderedDict
+import numpy as np
+
+# %%
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))                  # giây kể từ lần dùng cuối
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "500"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+SESSION_DIR = os.getenv("SESSION_DIR")                                  # không đặt -> chỉ giữ trong RAM
+DEFAULT_SESSION_ID = "default"
+
+_current_session = contextvars.ContextVar("session_id", default=DEFAULT_SESSION_ID)
+
+
+def current_session_id() -> str:
+    """Session của request đang chạy (các tool của agent đọc state theo ID này)."""
+    return _current_session.get()
+
+
+@contextmanager
+def use_session(session_id):
+    token = _current_session.set(session_id or DEFAULT_SESSION_ID)
+    try:
+        yield
+    finally:
+        _current_session.reset(token)
+
+
+def _approx_size(value) -> int:
+    """Ước lượng số byte của một giá trị trong session (text, embedding, list/dict skill...)."""
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_approx_size(k) + _approx_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sum(_approx_size(v) for v in value)
+    return 16
+
+# %%
+class SessionStore:
+    """
+    State theo session: text CV/JD đã trích xuất và các kết quả dẫn xuất (embedding, skill, điểm...).
+    - RAM: LRU theo lần dùng cuối, giới hạn số session (max_sessions) và tổng dung lượng (max_bytes).
+    - Session quá ttl giây không dùng thì hết hạn.
+    - disk_dir (tùy chọn): ghi mỗi session ra <disk_dir>/<hash>.pkl; session bị đẩy khỏi RAM
+      vẫn đọc lại được từ đĩa cho đến khi hết hạn. Hạn trên đĩa tính theo mtime của file,
+      được cập nhật cả khi session chỉ được đọc.
+    """
+    def __init__(self, ttl=SESSION_TTL, max_sessions=SESSION_MAX_SESSIONS, max_bytes=SESSION_MAX_BYTES, disk_dir=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+        self._sessions = OrderedDict()    # session_id -> {"data", "size", "touched"}
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._last_purge = time.time()
+        self.hits = self.misses = self.evictions = 0
+
+    # ----- đĩa -----
+    def _path(self, session_id):
+        name = hashlib.sha256(str(session_id).encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, name + ".pkl")
+
+    def _load_from_disk(self, session_id):
+        if not self.disk_dir:
+            return None
+        path = self._path(session_id)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+            os.utime(path)
+            return data
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def _touch_disk(self, session_id, entry):
+        # Đọc cũng tính là dùng: cập nhật mtime để file không hết hạn khi session vẫn đang được đọc
+        # (tối đa một lần mỗi phút cho mỗi session)
+        now = time.time()
+        if not self.disk_dir or now - entry.get("disk_touched", 0) < min(60, self.ttl / 10):
+            return
+        entry["disk_touched"] = now
+        try:
+            os.utime(self._path(session_id))
+        except OSError:
+            pass
+
+    def _save_to_disk(self, session_id, data):
+        if not self.disk_dir:
+            return
+        # Tên file tạm duy nhất (kể cả giữa các process cùng ghi một session), rồi thay thế nguyên tử
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(session_id))
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    # ----- RAM -----
+    def _entry(self, session_id, create=False):
+        entry = self._sessions.get(session_id)
+        if entry is not None and time.time() - entry["touched"] > self.ttl:
+            self._drop(session_id)
+            entry = None
+        if entry is None:
+            data = self._load_from_disk(session_id)
+            if data is None and not create:
+                return None
+            entry = {"data": data or {}, "size": 0, "touched": time.time(), "disk_touched": time.time()}
+            entry["size"] = _approx_size(entry["data"])
+            self._sessions[session_id] = entry
+            self._bytes += entry["size"]
+            self._enforce_caps(keep=session_id)
+        entry["touched"] = time.time()
+        self._touch_disk(session_id, entry)
+        self._sessions.move_to_end(session_id)
+        return entry
+
+    def _drop(self, session_id):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry["size"]
+
+    def _enforce_caps(self, keep=None):
+        # Session dùng lâu nhất bị đẩy ra trước; session đang ghi (keep) giữ lại
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes):
+            oldest = next(iter(self._sessions))
+            if oldest == keep:
+                self._sessions.move_to_end(oldest)
+                oldest = next(iter(self._sessions))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def purge_expired(self):
+        """Xóa các session đã hết hạn (RAM và đĩa)."""
+        now = time.time()
+        with self._lock:
+            for session_id in [s for s, e in self._sessions.items() if now - e["touched"] > self.ttl]:
+                self._drop(session_id)
+            self._last_purge = now
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                path = os.path.join(self.disk_dir, name)
+                try:
+                    if now - os.path.getmtime(path) > self.ttl:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    # ----- API -----
+    def get(self, session_id, key, default=None):
+        with self._lock:
+            entry = self._entry(session_id)
+            if entry is None or key not in entry["data"]:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry["data"][key]
+
+    def get_all(self, session_id) -> dict:
+        with self._lock:
+            entry = self._entry(session_id)
+            return dict(entry["data"]) if entry else {}
+
+    def set(self, session_id, replace=False, **values):
+        """Ghi các giá trị vào session; replace=True thì bỏ hết state cũ của session trước."""
+        with self._lock:
+            entry = self._entry(session_id, create=True)
+            data = {} if replace else dict(entry["data"])
+            data.update(values)
+            size = _approx_size(data)
+            self._bytes += size - entry["size"]
+            entry["data"], entry["size"] = data, size
+            self._enforce_caps(keep=session_id)
+            self._save_to_disk(session_id, data)
+        if time.time() - self._last_purge > 60:
+            self.purge_expired()
+
+    def discard(self, session_id, *keys):
+        """Bỏ các key (vd: kết quả dẫn xuất đã cũ khi text CV/JD thay đổi)."""
+        with self._lock:
+            entry = self._entry(session_id)
+            if entry is None or not any(k in entry["data"] for k in keys):
+                return
+            data = {k: v for k, v in entry["data"].items() if k not in keys}
+            size = _approx_size(data)
+            self._bytes += size - entry["size"]
+            entry["data"], entry["size"] = data, size
+            self._save_to_disk(session_id, data)
+
+    def clear(self, session_id):
+        with self._lock:
+            self._drop(session_id)
+            if self.disk_dir:
+                try:
+                    os.remove(self._path(session_id))
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "disk_dir": self.disk_dir,
+            }
+
+
+session_store = SessionStore(disk_dir=SESSION_DIR)
+
+# %%
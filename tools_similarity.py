@@ -1,46 +1,629 @@
 # %%
-import torch
-from sentence_transformers import SentenceTransformer, util
 import re
-import unicodedata
+import os
+import sys
+import time
+import subprocess
+import importlib.util
+import json
+import zlib
+import bisect
+import hashlib
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+import numpy as np
+from tools_text import preprocess_text
 
 # %%
 MODEL_PATH = "sentence-transformers/all-MiniLM-L6-v2"
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"    
+DEVICE = os.getenv("SIM_DEVICE")    # None: tự chọn cuda/cpu lúc load model
+SIM_CACHE_DIR = os.getenv("SIM_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "embeddings"))
+IMPORT_TIME_BUDGET = 1.0    # giây, xem measure_import_time()
+
+# Backend suy luận: torch (fp32), torch-int8 (dynamic quantization), onnx, onnx-int8 (ONNX Runtime)
+SIM_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+SIM_BACKEND = os.getenv("SIM_BACKEND", "torch")
+_ONNX_EXTRAS = ("onnxruntime", "optimum")
+if SIM_BACKEND not in SIM_BACKENDS:
+    print(f"⚠️ Unknown SIM_BACKEND={SIM_BACKEND!r} (expected one of {SIM_BACKENDS}); using 'torch'.")
+    SIM_BACKEND = "torch"
+elif SIM_BACKEND.startswith("onnx") and any(importlib.util.find_spec(m) is None for m in _ONNX_EXTRAS):
+    # Kiểm tra trước khi chọn SIM_MODEL_ID để cache embedding không bị trộn giữa hai backend
+    print(f"⚠️ SIM_BACKEND={SIM_BACKEND!r} needs the optional packages {_ONNX_EXTRAS} "
+          f"(see requirements.txt); using 'torch'.")
+    SIM_BACKEND = "torch"
+SIM_NUM_THREADS = int(os.getenv("SIM_NUM_THREADS", "0"))    # 0: để thư viện tự chọn
+SIM_ONNX_INT8_FILE = os.getenv("SIM_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+# Embedding khác backend thì khác nhau một chút -> không dùng chung cache với fp32
+SIM_MODEL_ID = MODEL_PATH if SIM_BACKEND == "torch" else f"{MODEL_PATH}#{SIM_BACKEND}"
 
 # %%
-print(f"⏳ Loading Similarity Model on {DEVICE}...")
-try:
-    sim_model = SentenceTransformer(MODEL_PATH, device=DEVICE)
-    print("✅ Similarity Model loaded.")
-except Exception as e:
-    print(f"⚠️ Error loading Similarity Model: {e}")
-    sim_model = None
+# torch / sentence-transformers chỉ được import khi thật sự cần tính điểm
+sim_model = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+
+def _load_model(backend=SIM_BACKEND, num_threads=SIM_NUM_THREADS, device=None):
+    import torch
+    from sentence_transformers import SentenceTransformer
+    if backend not in SIM_BACKENDS:
+        raise ValueError(f"backend must be one of {SIM_BACKENDS}, got {backend!r}")
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+    if backend == "torch":
+        device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        return SentenceTransformer(MODEL_PATH, device=device)
+    if backend == "torch-int8":
+        model = SentenceTransformer(MODEL_PATH, device="cpu")
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+    model_kwargs = {}
+    if backend == "onnx-int8":
+        model_kwargs["file_name"] = SIM_ONNX_INT8_FILE
+    if num_threads:
+        import onnxruntime
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = num_threads
+        model_kwargs["session_options"] = session_options
+    return SentenceTransformer(MODEL_PATH, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+
+def _use_torch_backend():
+    # Embedding của torch khác backend cũ một chút: chuyển sang cache riêng của torch
+    global SIM_BACKEND, SIM_MODEL_ID, embedding_cache
+    SIM_BACKEND, SIM_MODEL_ID = "torch", MODEL_PATH
+    embedding_cache = EmbeddingCache(SIM_MODEL_ID, cache_dir=SIM_CACHE_DIR)
+
+
+def get_sim_model():
+    """
+    Load model ở lần dùng đầu tiên (thread-safe), chỉ thử một lần cho cả process.
+    Backend khác torch lỗi thì cảnh báo và chuyển hẳn về torch; torch cũng lỗi thì trả về None như trước.
+    """
+    global sim_model, _model_loaded, DEVICE
+    if _model_loaded:
+        return sim_model
+    with _model_lock:
+        if not _model_loaded:
+            backends = [SIM_BACKEND] if SIM_BACKEND == "torch" else [SIM_BACKEND, "torch"]
+            for backend in backends:
+                try:
+                    if backend != SIM_BACKEND:
+                        print("⚠️ Falling back to SIM_BACKEND='torch'.")
+                        _use_torch_backend()
+                    print(f"⏳ Loading Similarity Model ({backend})...")
+                    sim_model = _load_model(backend, SIM_NUM_THREADS, DEVICE)
+                    DEVICE = str(sim_model.device)
+                    print(f"✅ Similarity Model loaded on {DEVICE} ({backend}).")
+                    break
+                except Exception as e:
+                    print(f"⚠️ Error loading Similarity Model ({backend}): {e}")
+                    sim_model = None
+            _model_loaded = True
+    return sim_model
+
+
+def warm_up() -> bool:
+    """Load model và encode thử một câu, gọi lúc khởi động để request đầu tiên không phải chờ."""
+    model = get_sim_model()
+    if model is None:
+        return False
+    model.encode(["warm up"])
+    return True
+
+
+def measure_import_time(module_name: str = "tools_similarity") -> float:
+    """Đo thời gian import module (giây) trong một process Python mới, so với IMPORT_TIME_BUDGET."""
+    code = f"import time; t = time.perf_counter(); import {module_name}; print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(result.stdout.strip().splitlines()[-1])
+
+# %%
+@contextmanager
+def _file_lock(path):
+    """Khóa độc quyền giữa các process (app và screen.py dùng chung SIM_CACHE_DIR)."""
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:    # LK_LOCK chỉ chờ ~10 giây rồi báo lỗi
+                    continue
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class EmbeddingCache:
+    """
+    Cache embedding theo nội dung: key = sha256(model name + text đã preprocess).
+    - Tầng RAM: LRU tối đa max_memory_items vector.
+    - Tầng đĩa (nếu có cache_dir): vectors.f32 (memmap float32, ghi nối tiếp) + keys.txt
+      (dòng i = "key crc32" của hàng i), giữ được qua các lần khởi động lại. Vượt max_disk_items thì
+      bỏ các vector cũ nhất. Nhiều process dùng chung thư mục: ghi/compact dưới file lock, hàng bắt đầu
+      lấy theo nội dung file chứ không theo state trong RAM, vector đọc ra được kiểm tra lại bằng crc32.
+    """
+    DISK_FORMAT = 2
+
+    def __init__(self, model_name, cache_dir=None, max_memory_items=10000, max_disk_items=200000):
+        self.model_name = model_name
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self.evictions = {"memory": 0, "disk": 0}
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._dir = None
+        self._dim = None
+        self._disk_rows = {}       # key -> (hàng, crc32)
+        self._n_rows = 0           # số hàng hợp lệ trong vectors.f32 (key trùng do 2 process cùng ghi vẫn chiếm hàng)
+        self._keys_bytes = 0       # số byte keys.txt đã đọc
+        self._keys_ino = None      # inode keys.txt lúc đọc; đổi nghĩa là process khác đã compact / clear
+        self._vectors = None
+        if cache_dir:
+            self._dir = os.path.join(cache_dir, re.sub(r"[^\w.-]", "_", model_name))
+            os.makedirs(self._dir, exist_ok=True)
+            with self._lock, _file_lock(self._path("lock")):
+                self._sync_disk()
+
+    def key(self, processed_text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{processed_text}".encode("utf-8")).hexdigest()
+
+    # ----- tầng đĩa -----
+    def _path(self, name):
+        return os.path.join(self._dir, name)
+
+    def _reset_disk(self):
+        for name in ("vectors.f32", "keys.txt", "meta.json"):
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+        self._dim = None
+        self._disk_rows = {}
+        self._n_rows = self._keys_bytes = 0
+        self._keys_ino = None
+        self._vectors = None
+
+    def _disk_changed(self) -> bool:
+        try:
+            st = os.stat(self._path("keys.txt"))
+        except FileNotFoundError:
+            return self._keys_ino is not None
+        return st.st_ino != self._keys_ino or st.st_size != self._keys_bytes
+
+    def _sync_disk(self):
+        """
+        Đọc các hàng process khác mới ghi thêm và cắt phần đuôi ghi dở (process chết giữa chừng)
+        để lần ghi sau bắt đầu đúng hàng. Chỉ gọi khi đang giữ file lock.
+        """
+        if self._dim is None:
+            if not os.path.exists(self._path("meta.json")):
+                return
+            with open(self._path("meta.json")) as f:
+                meta = json.load(f)
+            if meta.get("format") != self.DISK_FORMAT:
+                self._reset_disk()    # keys.txt kiểu cũ không có crc32
+                return
+            self._dim = meta["dim"]
+
+        keys_path, vectors_path = self._path("keys.txt"), self._path("vectors.f32")
+        try:
+            st = os.stat(keys_path)
+        except FileNotFoundError:
+            st = None
+        if st is None or st.st_ino != self._keys_ino or st.st_size < self._keys_bytes:
+            self._disk_rows = {}
+            self._n_rows = self._keys_bytes = 0
+            self._keys_ino = st.st_ino if st else None
+
+        row_bytes = 4 * self._dim
+        vector_rows = os.path.getsize(vectors_path) // row_bytes if os.path.exists(vectors_path) else 0
+        if st is not None and st.st_size > self._keys_bytes:
+            with open(keys_path, "rb") as f:
+                f.seek(self._keys_bytes)
+                for raw in f:
+                    parts = raw.split()
+                    # Chỉ tin các hàng có đủ cả dòng key lẫn vector
+                    if not raw.endswith(b"\n") or len(parts) != 2 or self._n_rows >= vector_rows:
+                        break
+                    self._disk_rows[parts[0].decode("ascii")] = (self._n_rows, int(parts[1], 16))
+                    self._n_rows += 1
+                    self._keys_bytes += len(raw)
+            if self._keys_bytes < st.st_size:
+                with open(keys_path, "r+b") as f:
+                    f.truncate(self._keys_bytes)
+        if os.path.exists(vectors_path) and os.path.getsize(vectors_path) > self._n_rows * row_bytes:
+            try:
+                with open(vectors_path, "r+b") as f:
+                    f.truncate(self._n_rows * row_bytes)
+            except OSError:
+                pass    # Windows không cắt được file đang map; _append_disk vẫn ghi đè từ đúng hàng
+        self._remap(self._n_rows)
+
+    def _remap(self, n_rows):
+        self._vectors = None
+        if n_rows:
+            self._vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="r", shape=(n_rows, self._dim))
+
+    def _append_disk(self, keys, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with _file_lock(self._path("lock")):
+            self._sync_disk()
+            if self._dim is None:
+                self._dim = int(vectors.shape[1])
+                with open(self._path("meta.json"), "w") as f:
+                    json.dump({"model": self.model_name, "dim": self._dim, "format": self.DISK_FORMAT}, f)
+            # Key process khác vừa ghi thì không ghi lại
+            fresh = [(k, v) for k, v in zip(keys, vectors) if k not in self._disk_rows]
+            if not fresh:
+                return
+            start = self._n_rows
+            vectors_path = self._path("vectors.f32")
+            with open(vectors_path, "r+b" if os.path.exists(vectors_path) else "wb") as f:
+                f.seek(start * 4 * self._dim)
+                f.write(b"".join(v.tobytes() for _, v in fresh))
+            lines = [f"{k} {zlib.crc32(v.tobytes()):08x}\n" for k, v in fresh]
+            data = "".join(lines).encode("ascii")
+            with open(self._path("keys.txt"), "ab") as f:
+                f.write(data)
+                self._keys_ino = os.fstat(f.fileno()).st_ino
+            for i, (k, v) in enumerate(fresh):
+                self._disk_rows[k] = (start + i, zlib.crc32(v.tobytes()))
+            self._n_rows += len(fresh)
+            self._keys_bytes += len(data)
+            if len(self._disk_rows) > self.max_disk_items:
+                self._compact_disk()
+            else:
+                self._remap(self._n_rows)
+
+    def _compact_disk(self):
+        # Giữ lại một nửa giới hạn (các vector mới nhất) để không phải compact liên tục. Gọi khi đang giữ file lock.
+        keep = self.max_disk_items // 2
+        keys = sorted(self._disk_rows, key=lambda k: self._disk_rows[k][0])
+        kept_keys = keys[-keep:] if keep else []
+        self._remap(self._n_rows)
+        kept = np.array(self._vectors[[self._disk_rows[k][0] for k in kept_keys]], dtype=np.float32)
+        self._vectors = None
+        data = "".join(f"{k} {self._disk_rows[k][1]:08x}\n" for k in kept_keys).encode("ascii")
+        with open(self._path("vectors.f32.tmp"), "wb") as f:
+            f.write(kept.tobytes())
+        with open(self._path("keys.txt.tmp"), "wb") as f:
+            f.write(data)
+        os.replace(self._path("vectors.f32.tmp"), self._path("vectors.f32"))
+        os.replace(self._path("keys.txt.tmp"), self._path("keys.txt"))
+        self.evictions["disk"] += len(keys) - len(kept_keys)
+        self._disk_rows = {k: (i, self._disk_rows[k][1]) for i, k in enumerate(kept_keys)}
+        self._n_rows = len(kept_keys)
+        self._keys_bytes = len(data)
+        self._keys_ino = os.stat(self._path("keys.txt")).st_ino
+        self._remap(self._n_rows)
+
+    # ----- API -----
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+            self.evictions["memory"] += 1
+
+    def get_many(self, keys):
+        """Trả về list vector (None nếu chưa có trong cache)."""
+        results = []
+        with self._lock:
+            # Key chưa thấy có thể do process khác vừa ghi thêm: đọc lại keys.txt nếu nó đã đổi
+            if self._dir and self._disk_changed() and any(
+                    k not in self._memory and k not in self._disk_rows for k in keys):
+                with _file_lock(self._path("lock")):
+                    self._sync_disk()
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.hits["memory"] += 1
+                    results.append(vector)
+                    continue
+                if key in self._disk_rows and self._vectors is not None:
+                    row, crc = self._disk_rows[key]
+                    vector = np.array(self._vectors[row])
+                    if zlib.crc32(vector.tobytes()) == crc:
+                        self._remember(key, vector)
+                        self.hits["disk"] += 1
+                        results.append(vector)
+                        continue
+                    del self._disk_rows[key]    # hàng không khớp key: coi như chưa có, lần put sau ghi lại
+                    vector = None
+                self.misses += 1
+                results.append(vector)
+        return results
+
+    def put_many(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            new_keys, new_rows = [], []
+            for key, vector in zip(keys, vectors):
+                # copy() để không giữ cả batch lớn trong RAM chỉ vì một hàng
+                self._remember(key, vector.copy())
+                if self._dir and key not in self._disk_rows:
+                    new_keys.append(key)
+                    new_rows.append(vector)
+            if new_keys:
+                self._append_disk(new_keys, np.stack(new_rows))
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._disk_rows = {}
+            self._vectors = None
+            if self._dir:
+                with _file_lock(self._path("lock")):
+                    self._reset_disk()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits["memory"] + self.hits["disk"] + self.misses
+            return {
+                "memory_items": len(self._memory),
+                "memory_bytes": sum(v.nbytes for v in self._memory.values()),
+                "disk_items": len(self._disk_rows),
+                "hits": dict(self.hits),
+                "misses": self.misses,
+                "hit_rate": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+                "evictions": dict(self.evictions),
+            }
+
+
+embedding_cache = EmbeddingCache(SIM_MODEL_ID, cache_dir=SIM_CACHE_DIR)
 
 # %%
-def preprocess_text(text):
-    text = unicodedata.normalize("NFC", text)
-    text = re.sub(r"<[^>]*>", " ", text)
-    text = re.sub(r"[@#]{2,}", " ", text)
-    text = re.sub(r"[^0-9a-zA-ZÀ-ỹ.,!?;:()\-\s]", " ", text)
-    text = text.lower()
-    text = re.sub(r"\s+", " ", text).strip()
-    return text
+SIM_BATCH_SIZE = 32
+
+
+def _encode_texts(texts, batch_size=SIM_BATCH_SIZE):
+    """
+    Encode cả list text, chỉ đưa vào model các text chưa có trong embedding_cache.
+    Trả về ma trận float32 (len(texts) x dim).
+    """
+    cache = embedding_cache
+    processed = [preprocess_text(t) for t in texts]
+    keys = [cache.key(p) for p in processed]
+    vectors = cache.get_many(keys)
+
+    # Text trùng nhau trong cùng batch chỉ encode một lần
+    missing = {}
+    for key, text, vector in zip(keys, processed, vectors):
+        if vector is None:
+            missing.setdefault(key, text)
+    if missing:
+        model = get_sim_model()
+        if embedding_cache is not cache:
+            # Lần load đầu vừa chuyển backend về torch: tra lại theo cache (và key) của torch
+            return _encode_texts(texts, batch_size)
+        encoded = model.encode(list(missing.values()), batch_size=batch_size, convert_to_numpy=True)
+        cache.put_many(list(missing), encoded)
+        fresh = dict(zip(missing, encoded))
+        vectors = [fresh[k] if v is None else v for k, v in zip(keys, vectors)]
+    return np.stack(vectors).astype(np.float32, copy=False)
+
+
+def _normalize(emb):
+    norms = np.linalg.norm(emb, axis=1, keepdims=True)
+    return emb / np.maximum(norms, 1e-12)
+
+
+def embed_texts(texts, batch_size: int = SIM_BATCH_SIZE):
+    """Embedding đã chuẩn hóa (float32, len(texts) x dim): cosine = tích vô hướng."""
+    return _normalize(_encode_texts(list(texts), batch_size))
+
 
 # %%
-def calculate_similarity(cv_text: str, jd_text: str) -> float:
+SIM_CHUNK_OVERLAP = 50    # token
+SIM_CHUNK_WORDS = 150     # chỉ dùng khi model không có tokenizer nhanh (ước lượng thô, text tiếng Việt vẫn có thể bị cắt)
+POOLING_MODES = ("mean", "max", "best_section")
+
+
+def _chunk_tokenizer():
+    """(tokenizer, số wordpiece tối đa mỗi chunk) của model đang dùng; (None, None) nếu không lấy được offset."""
+    model = get_sim_model()
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is None or not getattr(tokenizer, "is_fast", False):
+        return None, None
+    # Trừ [CLS] và [SEP] mà model tự thêm vào mỗi chuỗi
+    return tokenizer, model.max_seq_length - 2
+
+
+def _split_words(processed, chunk_words, overlap):
+    words = processed.split()
+    if len(words) <= chunk_words:
+        return [" ".join(words)]
+    step = max(chunk_words - overlap, 1)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+
+def split_into_chunks(text: str, chunk_tokens: int = None, overlap: int = SIM_CHUNK_OVERLAP) -> list:
+    """
+    Cắt text (sau preprocess_text) thành các cửa sổ tối đa chunk_tokens wordpiece theo tokenizer của model
+    (mặc định: max_seq_length của model), chồng lấn overlap token, chỉ cắt ở ranh giới từ.
+    Không có tokenizer nhanh: cửa sổ SIM_CHUNK_WORDS từ.
+    """
+    processed = preprocess_text(text)
+    tokenizer, max_tokens = _chunk_tokenizer()
+    if tokenizer is None:
+        return _split_words(processed, SIM_CHUNK_WORDS, min(overlap, SIM_CHUNK_WORDS // 2))
+    budget = min(chunk_tokens or max_tokens, max_tokens)
+    overlap = min(overlap, budget // 2)
+
+    offsets = tokenizer(processed, add_special_tokens=False, return_offsets_mapping=True,
+                        verbose=False)["offset_mapping"]
+    if len(offsets) <= budget:
+        return [processed]
+    # Token mở đầu một từ (preprocess_text đã gộp khoảng trắng thành một dấu cách)
+    word_starts = [i for i, (begin, _) in enumerate(offsets) if begin == 0 or processed[begin - 1] == " "]
+
+    chunks, start, n = [], 0, len(offsets)
+    while True:
+        end = min(start + budget, n)
+        if end < n:
+            # Lùi về đầu từ gần nhất để không cắt đôi một từ (từ dài hơn cả cửa sổ thì đành cắt)
+            cut = word_starts[bisect.bisect_right(word_starts, end) - 1]
+            if cut > start:
+                end = cut
+        chunks.append(processed[offsets[start][0]:offsets[end - 1][1]])
+        if end >= n:
+            return chunks
+        # Chunk sau bắt đầu ở đầu từ, lùi ít nhất overlap token so với cuối chunk trước
+        next_start = word_starts[bisect.bisect_right(word_starts, end - overlap) - 1]
+        start = next_start if next_start > start else end
+
+
+def _chunked_scores(cv_texts, jd_texts, batch_size, pooling, chunk_tokens, overlap):
+    """
+    Điểm N x M khi chia văn bản dài thành nhiều chunk.
+    - mean: trung bình embedding các chunk của mỗi văn bản rồi mới tính cosine.
+    - max: cặp chunk CV - chunk JD giống nhau nhất.
+    - best_section: mỗi chunk JD (nhóm yêu cầu) lấy chunk CV khớp nhất, rồi lấy trung bình.
+    """
+    chunks, offsets = [], [0]
+    for text in cv_texts + jd_texts:
+        chunks.extend(split_into_chunks(text, chunk_tokens, overlap))
+        offsets.append(len(chunks))
+    # Mọi chunk của mọi văn bản encode chung một lượt để batch luôn đầy
+    emb = _normalize(_encode_texts(chunks, batch_size))
+
+    n = len(cv_texts)
+    cv_off = np.array(offsets[:n + 1])
+    jd_off = np.array(offsets[n:]) - offsets[n]
+    cv_emb, jd_emb = emb[:offsets[n]], emb[offsets[n]:]
+
+    if pooling == "mean":
+        cv_doc = np.add.reduceat(cv_emb, cv_off[:-1]) / np.diff(cv_off)[:, None]
+        jd_doc = np.add.reduceat(jd_emb, jd_off[:-1]) / np.diff(jd_off)[:, None]
+        return _normalize(cv_doc) @ _normalize(jd_doc).T
+
+    sims = cv_emb @ jd_emb.T
+    scores = np.empty((n, len(jd_texts)), dtype=np.float32)
+    for i in range(n):
+        rows = sims[cv_off[i]:cv_off[i + 1]]
+        for j in range(len(jd_texts)):
+            block = rows[:, jd_off[j]:jd_off[j + 1]]
+            scores[i, j] = block.max() if pooling == "max" else block.max(axis=0).mean()
+    return scores
+
+
+def calculate_similarity_many(cv_texts, jd_texts, batch_size: int = SIM_BATCH_SIZE,
+                              chunked: bool = False, pooling: str = "mean",
+                              chunk_tokens: int = None, overlap: int = SIM_CHUNK_OVERLAP):
+    """
+    Tính điểm tương đồng cho nhiều CV cùng lúc.
+    - jd_texts là str: 1 JD với N CV -> list N điểm (JD chỉ encode một lần).
+    - jd_texts là list M JD: -> ma trận N x M (hàng = CV, cột = JD).
+    chunked=True: chấm trên toàn bộ văn bản dài thay vì chỉ phần đầu bị model cắt, gộp theo pooling.
+    """
+    if pooling not in POOLING_MODES:
+        raise ValueError(f"pooling must be one of {POOLING_MODES}, got {pooling!r}")
+    single_jd = isinstance(jd_texts, str)
+    if single_jd:
+        jd_texts = [jd_texts]
+    cv_texts, jd_texts = list(cv_texts), list(jd_texts)
+
+    if not cv_texts or not jd_texts or get_sim_model() is None:
+        scores = [[0.0] * len(jd_texts) for _ in cv_texts]
+    elif chunked:
+        scores = _chunked_scores(cv_texts, jd_texts, batch_size, pooling, chunk_tokens, overlap).tolist()
+    else:
+        emb = _normalize(_encode_texts(cv_texts + jd_texts, batch_size))
+        # Toàn bộ cosine N x M trong một phép nhân ma trận
+        scores = (emb[:len(cv_texts)] @ emb[len(cv_texts):].T).tolist()
+
+    scores = [[round(s, 4) for s in row] for row in scores]
+    if single_jd:
+        return [row[0] for row in scores]
+    return scores
+
+
+def calculate_similarity(cv_text: str, jd_text: str, chunked: bool = False, pooling: str = "mean") -> float:
     """Tool tính điểm tương đồng giữa CV và JD."""
-    if sim_model is None:
+    if get_sim_model() is None:
         return 0.0
         
-    processed_cv = preprocess_text(cv_text)
-    processed_jd = preprocess_text(jd_text)
-    
-    emb1 = sim_model.encode(processed_jd, convert_to_tensor=True)
-    emb2 = sim_model.encode(processed_cv, convert_to_tensor=True)
-    
-    similarity = util.cos_sim(emb1, emb2)
-    return round(similarity.item(), 4)
+    return calculate_similarity_many([cv_text], jd_text, chunked=chunked, pooling=pooling)[0]
+
+# %%
+# Bộ CV/JD cố định để so điểm của các backend với fp32
+BACKEND_EVAL_PAIRS = [
+    ("Python developer, 3 years Django, Flask, PostgreSQL, Docker, REST API.",
+     "Tuyển Backend Developer Python (Django/Flask), biết PostgreSQL và Docker."),
+    ("Data scientist: machine learning, pandas, scikit-learn, deep learning with PyTorch.",
+     "Looking for an ML engineer with PyTorch, TensorFlow and MLOps experience."),
+    ("Frontend engineer, React, TypeScript, HTML/CSS, Jest testing.",
+     "Senior Java Spring Boot developer for banking microservices."),
+    ("Kế toán tổng hợp, 5 năm kinh nghiệm, thành thạo Excel và phần mềm MISA.",
+     "Tuyển kế toán tổng hợp, ưu tiên biết MISA, báo cáo thuế."),
+    ("DevOps: Kubernetes, Terraform, AWS, CI/CD with Jenkins and GitLab.",
+     "Cloud engineer needed: AWS, Kubernetes, infrastructure as code."),
+    ("Project manager, Agile/Scrum, stakeholder communication, Jira.",
+     "Mobile developer Kotlin/Swift, publishing apps to stores."),
+    ("Computer vision researcher, OpenCV, object detection, segmentation.",
+     "NLP engineer: transformers, text classification, named entity recognition."),
+    ("Sales executive, B2B, CRM, negotiation, English fluent.",
+     "Nhân viên kinh doanh B2B, giao tiếp tiếng Anh tốt, dùng CRM."),
+]
+
+
+def compare_backends(backends=("torch-int8", "onnx", "onnx-int8"), pairs=None, repeats=5,
+                     num_threads=SIM_NUM_THREADS) -> dict:
+    """
+    So từng backend với fp32 (torch, CPU) trên bộ cặp cố định:
+    thời gian encode, tốc độ so với fp32 và độ lệch điểm (max/mean |Δ|).
+    """
+    pairs = pairs or BACKEND_EVAL_PAIRS
+    texts = [preprocess_text(t) for pair in pairs for t in pair]
+
+    def run(model):
+        model.encode(texts[:2])    # bỏ qua lần chạy đầu (khởi tạo)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            emb = model.encode(texts, batch_size=SIM_BATCH_SIZE, convert_to_numpy=True)
+        seconds = (time.perf_counter() - start) / repeats
+        emb = _normalize(emb.astype(np.float32))
+        return seconds, np.einsum("ij,ij->i", emb[0::2], emb[1::2])
+
+    ref_seconds, ref_scores = run(_load_model("torch", num_threads, "cpu"))
+    report = {"torch": {"seconds": round(ref_seconds, 4), "speedup": 1.0,
+                        "max_abs_diff": 0.0, "mean_abs_diff": 0.0}}
+    for backend in backends:
+        try:
+            seconds, scores = run(_load_model(backend, num_threads))
+        except Exception as e:
+            report[backend] = {"error": str(e)}
+            continue
+        diff = np.abs(scores - ref_scores)
+        report[backend] = {
+            "seconds": round(seconds, 4),
+            "speedup": round(ref_seconds / seconds, 2),
+            "max_abs_diff": round(float(diff.max()), 4),
+            "mean_abs_diff": round(float(diff.mean()), 4),
+        }
+    return report
 
 # %%
 
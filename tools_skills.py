@@ -1,5 +1,8 @@
 # %%
+import os
 import re
+import pickle
+from multiprocessing import Pool
 
 # %%
 COMMON_SKILLS_DB = {
@@ -8,35 +11,257 @@ COMMON_SKILLS_DB = {
     # Frameworks & Libraries
     "react", "angular", "vue", "django", "flask", "spring boot", "node.js", "express", "tensorflow", "pytorch", "pandas", "numpy", "scikit-learn", "keras", "jquery", "bootstrap", ".net",
     # Tools & Platforms
-    "git", "github", "gitlab", "docker", "kubernetes", "aws", "azure", "google cloud", "gcp", "jenkins", "jira", "linux", "unix", "postman",
+    "git", "github", "gitlab", "docker", "kubernetes", "aws", "azure", "google cloud", "jenkins", "jira", "linux", "unix", "postman",
     # Databases
     "mysql", "postgresql", "mongodb", "oracle", "redis", "elasticsearch", "sql server",
     # Concepts / Soft Skills
     "machine learning", "deep learning", "data analysis", "data science", "artificial intelligence", "nlp", "computer vision", "agile", "scrum", "communication", "leadership", "problem solving", "teamwork", "project management"
 }
 
+# Biến thể cách viết -> skill chuẩn (canonical ID) trong COMMON_SKILLS_DB
+SKILL_ALIASES = {
+    "cpp": "c++", "c sharp": "c#", "golang": "go",
+    "reactjs": "react", "react.js": "react", "angularjs": "angular", "vuejs": "vue", "vue.js": "vue",
+    "nodejs": "node.js", "express.js": "express", "expressjs": "express", "sklearn": "scikit-learn",
+    "dotnet": ".net", "asp.net": ".net",
+    "k8s": "kubernetes", "amazon web services": "aws", "microsoft azure": "azure", "gcp": "google cloud", "google cloud platform": "google cloud",
+    "postgres": "postgresql", "mongo": "mongodb", "elastic search": "elasticsearch", "mssql": "sql server", "ms sql server": "sql server",
+    "natural language processing": "nlp",
+    "problem-solving": "problem solving", "team work": "teamwork",
+}
+
+# Alias viết tắt hai chữ chỉ khớp đúng chữ hoa: "ai" thường là từ tiếng Việt ("Ai là người phù hợp?"),
+# "ml" là mililit ("100 ml"), "ts"/"dl" là viết tắt khác (timestamp, download...)
+CASED_SKILL_ALIASES = {
+    "AI": "artificial intelligence",
+    "ML": "machine learning",
+    "DL": "deep learning",
+    "JS": "javascript",
+    "TS": "typescript",
+}
+
+# File taxonomy (tùy chọn): mỗi dòng "skill chuẩn|alias1|alias2", dòng bắt đầu bằng # là chú thích
+SKILL_TAXONOMY_PATH = os.getenv(
+    "SKILL_TAXONOMY_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "skills_taxonomy.txt"),
+)
+
+# %%
+def _build_skill_trie(skills) -> dict:
+    """Dựng trie ký tự từ danh sách skill, nút kết thúc đánh dấu bằng key ''."""
+    root = {}
+    for skill in skills:
+        node = root
+        for ch in skill:
+            node = node.setdefault(ch, {})
+        node[''] = skill
+    return root
+
+
+def _trie_to_pattern(node: dict, is_root: bool = False) -> str:
+    # Nhánh dài hơn đứng trước để regex ưu tiên skill dài nhất (vd: 'sql server' trước 'sql')
+    branches = []
+    for ch in sorted(k for k in node if k):
+        branch = re.escape(ch) + _trie_to_pattern(node[ch])
+        # Giữ đúng quy tắc \b cũ ở cạnh là chữ/số; cạnh là dấu (c++, c#, .net) thì tự nó đã là ranh giới
+        if is_root and re.match(r'\w', ch):
+            branch = r'(?<!\w)' + branch
+        branches.append(branch)
+    if '' in node:
+        branches.append(r'(?!\w)' if re.match(r'\w', node[''][-1]) else '')
+    if len(branches) == 1:
+        return branches[0]
+    return '(?:' + '|'.join(branches) + ')'
+
+
+def _prefix_skills(trie: dict, skill: str) -> tuple:
+    """Các skill ngắn hơn là tiền tố hợp lệ của `skill` (regex chỉ trả về skill dài nhất tại một vị trí)."""
+    found = []
+    node = trie
+    for i, ch in enumerate(skill[:-1]):
+        node = node[ch]
+        shorter = node.get('')
+        if shorter and not (re.match(r'\w', shorter[-1]) and re.match(r'\w', skill[i + 1])):
+            found.append(shorter)
+    return tuple(found)
+
+
+def _build_skill_pattern(surface_forms):
+    """Trả về (regex source, prefix_map) của trie; chỉ giữ các prefix không rỗng cho nhẹ bộ nhớ."""
+    trie = _build_skill_trie(surface_forms)
+    # Lookahead để bắt cả các skill chồng lấn nhau trong một lần quét
+    pattern_source = '(?=(' + _trie_to_pattern(trie, is_root=True) + '))'
+    prefix_map = {}
+    for skill in surface_forms:
+        prefixes = _prefix_skills(trie, skill)
+        if prefixes:
+            prefix_map[skill] = prefixes
+    return pattern_source, prefix_map
+
+# %%
+class SkillTaxonomy:
+    """
+    Bộ skill chuẩn + alias, quét text bằng một regex trie biên dịch một lần.
+    Kết quả luôn là skill chuẩn (canonical ID) để so sánh CV/JD không bị lệch vì cách viết.
+    """
+    def __init__(self, skills, aliases=None, pattern_source=None, prefix_map=None, cased_aliases=None):
+        self.skills = frozenset(s.strip().lower() for s in skills if s.strip())
+        self.aliases = {a.strip().lower(): c.strip().lower() for a, c in (aliases or {}).items() if a.strip()}
+        self.cased_aliases = {a.strip(): c.strip().lower() for a, c in (cased_aliases or {}).items() if a.strip()}
+        self._pattern_source = pattern_source
+        self._prefix_map = prefix_map
+        self._pattern = None
+        self._cased_pattern = None
+
+    @classmethod
+    def from_file(cls, path):
+        """Đọc taxonomy từ file text; dùng index dựng sẵn (path + '.idx') nếu còn mới hơn file gốc."""
+        index_path = path + ".idx"
+        if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path):
+            with open(index_path, "rb") as f:
+                data = pickle.load(f)
+            return cls(data["skills"], data["aliases"], data["pattern_source"], data["prefix_map"],
+                       data.get("cased_aliases"))
+
+        # Alias viết trong ngoặc kép ("AI") thì chỉ khớp đúng chữ hoa/thường như trong file
+        skills, aliases, cased_aliases = set(), {}, {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                names = [n.strip() for n in line.split("|") if n.strip()]
+                canonical = names[0].lower()
+                skills.add(canonical)
+                for alias in names[1:]:
+                    if len(alias) > 2 and alias[0] == alias[-1] == '"':
+                        cased_aliases[alias[1:-1]] = canonical
+                    else:
+                        aliases[alias.lower()] = canonical
+        return cls(skills, aliases, cased_aliases=cased_aliases)
+
+    def save_index(self, path):
+        """
+        Ghi nguồn regex trie + prefix_map + alias ra path + '.idx' để lần load sau không phải dựng trie.
+        Lưu ý: Python không lưu được regex đã biên dịch, re.compile vẫn chạy một lần trong mỗi process
+        (lười, ở lần extract đầu tiên).
+        """
+        self._ensure_pattern_source()
+        with open(path + ".idx", "wb") as f:
+            pickle.dump({
+                "skills": sorted(self.skills),
+                "aliases": self.aliases,
+                "cased_aliases": self.cased_aliases,
+                "pattern_source": self._pattern_source,
+                "prefix_map": self._prefix_map,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _ensure_pattern_source(self):
+        if self._pattern_source is None:
+            surface_forms = self.skills | set(self.aliases)
+            self._pattern_source, self._prefix_map = _build_skill_pattern(surface_forms)
+
+    @property
+    def pattern(self):
+        # Biên dịch lười ở lần dùng đầu tiên: taxonomy lớn không làm chậm lúc import
+        if self._pattern is None:
+            self._ensure_pattern_source()
+            self._pattern = re.compile(self._pattern_source)
+        return self._pattern
+
+    def canonicalize(self, skill: str) -> str:
+        skill = skill.strip().lower()
+        return self.aliases.get(skill, skill)
+
+    @property
+    def cased_pattern(self):
+        if self._cased_pattern is None and self.cased_aliases:
+            alternatives = '|'.join(re.escape(a) for a in sorted(self.cased_aliases, key=len, reverse=True))
+            self._cased_pattern = re.compile(r'(?<![\w.])(' + alternatives + r')(?!\w)')
+        return self._cased_pattern
+
+    def extract(self, text: str) -> set:
+        """Quét text một lượt, trả về tập skill chuẩn."""
+        pattern = self.pattern
+        prefix_map, aliases = self._prefix_map, self.aliases
+        lowered = text.lower()
+        found_skills = set()
+        for match in pattern.finditer(lowered):
+            surface = match.group(1)
+            # Alias đứng ngay sau dấu chấm là đuôi của tên khác ('js' trong 'node.js'), không tính
+            after_dot = match.start() > 0 and lowered[match.start() - 1] == '.'
+            for form in (surface,) + prefix_map.get(surface, ()):
+                if form in aliases:
+                    if not after_dot:
+                        found_skills.add(aliases[form])
+                else:
+                    found_skills.add(form)
+        if self.cased_pattern is not None:
+            for match in self.cased_pattern.finditer(text):
+                found_skills.add(self.cased_aliases[match.group(1)])
+        return found_skills
+
+
+def build_taxonomy_index(path=SKILL_TAXONOMY_PATH) -> SkillTaxonomy:
+    """Dựng sẵn index cho file taxonomy (chạy lại khi file thay đổi)."""
+    taxonomy = SkillTaxonomy.from_file(path)
+    taxonomy.save_index(path)
+    return taxonomy
+
+
+def load_skill_taxonomy(path=SKILL_TAXONOMY_PATH) -> SkillTaxonomy:
+    """Load taxonomy từ file nếu có, ngược lại dùng COMMON_SKILLS_DB + SKILL_ALIASES."""
+    if path and os.path.exists(path):
+        try:
+            return SkillTaxonomy.from_file(path)
+        except Exception as e:
+            print(f"⚠️ Error loading Skill Taxonomy: {e}")
+    return SkillTaxonomy(COMMON_SKILLS_DB, SKILL_ALIASES, cased_aliases=CASED_SKILL_ALIASES)
+
+
+skill_taxonomy = load_skill_taxonomy()
+
 # %%
 def extract_skills_from_text(text: str) -> list:
     """
-    Phiên bản 'nhẹ': Quét text và tìm từ khóa có trong danh sách skill.
+    Phiên bản 'nhẹ': Quét text một lượt bằng matcher đã biên dịch sẵn.
+    Trả về skill chuẩn (alias như 'k8s' -> 'kubernetes').
     """
     if not text:
         return []
     
-    text_lower = text.lower()
-    found_skills = set()
-    
-    # Cách 1: Tìm chính xác từ (đơn giản)
-    for skill in COMMON_SKILLS_DB:
-        # Dùng regex để đảm bảo bắt đúng từ (ví dụ không bắt 'java' trong 'javascript')
-        # \b là ranh giới từ
-        pattern = r'\b' + re.escape(skill) + r'\b'
-        if re.search(pattern, text_lower):
-            found_skills.add(skill)
-            
-    return list(found_skills)
+    # Ranh giới từ giống \b cũ: không bắt 'java' trong 'javascript'
+    return list(skill_taxonomy.extract(text))
+
+
+
+def check_alias_matches():
+    """Kiểm tra nhanh alias viết tắt: khớp đúng chữ hoa, không khớp từ thường / đuôi sau dấu chấm."""
+    positives = {
+        "AI engineer": "artificial intelligence", "ML pipelines": "machine learning",
+        "DL models": "deep learning", "JS, HTML": "javascript", "TS and React": "typescript",
+    }
+    negatives = [
+        "Ai là người phù hợp?", "uống 100 ml nước", "dl: 20/10", "log ts=1700000000", "js bin",
+        "Node.js developer", "Vue.JS",
+    ]
+    for text, skill in positives.items():
+        assert skill in extract_skills_from_text(text), (text, skill)
+    for text in negatives:
+        found = set(extract_skills_from_text(text)) & set(CASED_SKILL_ALIASES.values())
+        assert not found, (text, found)
 
 # %%
+def _compare_skill_sets(cv_skills: set, jd_skills: set) -> dict:
+    # Sắp xếp để kết quả giống hệt nhau dù tính ở process nào
+    return {
+        "cv_skills": sorted(cv_skills),
+        "jd_skills": sorted(jd_skills),
+        "matched_skills": sorted(cv_skills & jd_skills),
+        "missing_skills": sorted(jd_skills - cv_skills)
+    }
+
+
 def compare_skills_tool(cv_text: str, jd_text: str) -> dict:
     """
     Tool so sánh kỹ năng, trả về skills khớp và skills thiếu.
@@ -47,15 +272,59 @@ def compare_skills_tool(cv_text: str, jd_text: str) -> dict:
     # 2. Trích xuất skill từ JD
     jd_skills = set(extract_skills_from_text(jd_text))
     
-    # 3. So sánh
-    matched = list(cv_skills.intersection(jd_skills))
-    missing = list(jd_skills.difference(cv_skills))
-    
+    # 3. So sánh theo skill chuẩn (canonical ID)
+    return _compare_skill_sets(cv_skills, jd_skills)
+
+# %%
+_WORKER_JD_SKILLS = None
+
+
+def _init_compare_worker(jd_skills):
+    global _WORKER_JD_SKILLS
+    _WORKER_JD_SKILLS = jd_skills
+
+
+def _compare_cv_in_worker(cv_text):
+    return _compare_skill_sets(set(extract_skills_from_text(cv_text)), _WORKER_JD_SKILLS)
+
+
+def iter_compare_skills(cv_texts, jd_text: str, workers: int = 0, chunksize: int = 64):
+    """
+    So sánh MỘT JD với nhiều CV: JD chỉ trích xuất một lần, CV được xử lý dạng stream.
+    workers > 0 thì chia CV cho process pool; kết quả trả về đúng thứ tự đầu vào.
+    """
+    jd_skills = set(extract_skills_from_text(jd_text))
+    if workers and workers > 0:
+        with Pool(workers, initializer=_init_compare_worker, initargs=(jd_skills,)) as pool:
+            yield from pool.imap(_compare_cv_in_worker, cv_texts, chunksize=chunksize)
+    else:
+        for cv_text in cv_texts:
+            yield _compare_skill_sets(set(extract_skills_from_text(cv_text)), jd_skills)
+
+
+def compare_skills_many(cv_texts, jd_text: str, workers: int = 0, chunksize: int = 64) -> dict:
+    """
+    Batch của compare_skills_tool: results[i] giống hệt compare_skills_tool(cv_texts[i], jd_text).
+    ranking xếp CV theo tỉ lệ skill JD được đáp ứng (cao -> thấp).
+    """
+    results = list(iter_compare_skills(cv_texts, jd_text, workers=workers, chunksize=chunksize))
+    jd_skills = sorted(extract_skills_from_text(jd_text)) if not results else results[0]["jd_skills"]
+
+    ranking = []
+    for index, result in enumerate(results):
+        n_matched = len(result["matched_skills"])
+        ranking.append({
+            "index": index,
+            "matched": n_matched,
+            "missing": len(result["missing_skills"]),
+            "coverage": round(n_matched / len(jd_skills), 4) if jd_skills else 0.0
+        })
+    ranking.sort(key=lambda r: (-r["coverage"], r["index"]))
+
     return {
-        "cv_skills": list(cv_skills),
-        "jd_skills": list(jd_skills),
-        "matched_skills": matched,
-        "missing_skills": missing
+        "jd_skills": jd_skills,
+        "results": results,
+        "ranking": ranking
     }
 
 # %%
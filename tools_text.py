@@ -0,0 +1,120 @@
+# %%
+import re
+import time
+import random
+import unicodedata
+
+# %%
+# Biên dịch một lần: các mẫu số trang (dùng với .match trên dòng đã strip, như re.match cũ)
+PAGE_MARKER_RE = re.compile(
+    r'page\s+\d+'           # page 3 / page 3 of 10
+    r'|página\s+\d+'
+    r'|\d+$'                # dòng chỉ có số
+    r'|page\s*\|\s*\d+'
+    r'|\d+\s*/\s*\d+'
+    r'|\d+\s+of\s+\d+',
+    re.IGNORECASE,
+)
+# Thẻ HTML hoặc ký tự ngoài bảng chữ cho phép -> khoảng trắng, gộp trong một lượt
+# ([@#]{2,} cũ đã nằm trong lớp ký tự bị loại nên không cần lượt riêng)
+DISALLOWED_RE = re.compile(r"<[^>]*>|[^0-9a-zA-ZÀ-ỹ.,!?;:()\-\s]")
+
+# %%
+def clean_extracted_text(text):
+    """Bỏ dòng trống và dòng số trang, gộp khoảng trắng trong dòng. Một lượt qua các dòng."""
+    if not text: return ""
+    match_marker = PAGE_MARKER_RE.match
+    cleaned_lines = []
+    for line in text.split('\n'):
+        line = line.strip()
+        if line and not match_marker(line):
+            cleaned_lines.append(' '.join(line.split()))
+    # Không còn dòng trống nên không cần gộp '\n\n\n' như trước
+    return '\n'.join(cleaned_lines)
+
+
+def preprocess_text(text):
+    """Chuẩn hóa text trước khi encode: NFC, bỏ thẻ/ký tự lạ, chữ thường, gộp khoảng trắng."""
+    text = unicodedata.normalize("NFC", text)
+    text = DISALLOWED_RE.sub(" ", text).lower()
+    return ' '.join(text.split())
+
+# %%
+def _reference_clean(text):
+    # Bản cũ của tools_ocr.clean_extracted_text, chỉ dùng để đo và đối chiếu
+    if not text: return ""
+    page_patterns = [
+        r'(?i)page\s+\d+(?:\s+of\s+\d+)?',
+        r'(?i)página\s+\d+',
+        r'^\s*\d+\s*$',
+        r'(?i)page\s*\|\s*\d+',
+        r'(?i)\d+\s*/\s*\d+',
+        r'(?i)\d+\s+of\s+\d+',
+    ]
+    cleaned_lines = []
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line: continue
+        if not any(re.match(pattern, line) for pattern in page_patterns):
+            cleaned_lines.append(re.sub(r'\s+', ' ', line))
+    result = re.sub(r'\n{3,}', '\n\n', '\n'.join(cleaned_lines))
+    return result.strip()
+
+
+def _reference_preprocess(text):
+    # Bản cũ của tools_similarity.preprocess_text
+    text = unicodedata.normalize("NFC", text)
+    text = re.sub(r"<[^>]*>", " ", text)
+    text = re.sub(r"[@#]{2,}", " ", text)
+    text = re.sub(r"[^0-9a-zA-ZÀ-ỹ.,!?;:()\-\s]", " ", text)
+    text = text.lower()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def make_ocr_dump(size_mb=4, seed=0):
+    """Sinh một bản OCR giả (nhiều trang, có số trang, thẻ, ký tự lạ, tiếng Việt) dài khoảng size_mb MB."""
+    rng = random.Random(seed)
+    words = ["Python", "developer", "kinh", "nghiệm", "Quản", "lý", "dự", "án", "SQL", "C++", "C#",
+             "<b>", "</b>", "##", "@@", "email@example.com", "2019-2023", "•", "—", "(AWS)", "Đại", "học"]
+    lines = []
+    size = 0
+    page = 1
+    while size < size_mb * 1024 * 1024:
+        if rng.random() < 0.03:
+            line = rng.choice([f"Page {page}", f"Page {page} of 40", f"{page}/40", f"  {page}  ", f"Page | {page}", ""])
+            page += 1
+        else:
+            line = "  ".join(rng.choice(words) for _ in range(rng.randint(3, 14)))
+        lines.append(line)
+        size += len(line.encode("utf-8")) + 1
+    return '\n'.join(lines)
+
+
+def benchmark_text_normalization(size_mb=4, repeats=3) -> dict:
+    """
+    Micro-benchmark MB/s trên một bản OCR lớn: bản cũ vs bản biên dịch sẵn.
+    Đồng thời kiểm tra kết quả mới giống hệt bản cũ.
+    """
+    text = make_ocr_dump(size_mb)
+    mb = len(text.encode("utf-8")) / (1024 * 1024)
+
+    def throughput(fn):
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn(text)
+            best = min(best, time.perf_counter() - start)
+        return round(mb / best, 2)
+
+    expected_clean = _reference_clean(text)
+    assert clean_extracted_text(text) == expected_clean
+    assert preprocess_text(expected_clean) == _reference_preprocess(expected_clean)
+    return {
+        "size_mb": round(mb, 2),
+        "clean_reference_mb_s": throughput(_reference_clean),
+        "clean_mb_s": throughput(clean_extracted_text),
+        "preprocess_reference_mb_s": throughput(_reference_preprocess),
+        "preprocess_mb_s": throughput(preprocess_text),
+    }
+
+# %%